@@ -27,6 +27,7 @@
         'views/res_partner.xml',
         'views/bank_payment_line_view.xml',
         'views/account_move_line.xml',
+        'wizard/account_banking_mandate_import_view.xml',
         'data/mandate_reference_sequence.xml',
         'security/mandate_security.xml',
         'security/ir.model.access.csv',
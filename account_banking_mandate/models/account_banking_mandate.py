@@ -78,7 +78,7 @@ class AccountBankingMandate(models.Model):
                       "before the date of signature."
                       ) % mandate.unique_mandate_reference)
 
-    @api.constrains('company_id', 'payment_line_ids', 'partner_bank_id')
+    @api.constrains('company_id', 'partner_bank_id')
     def _company_constrains(self):
         for mandate in self:
             if mandate.partner_bank_id.company_id and \
@@ -88,41 +88,65 @@ class AccountBankingMandate(models.Model):
                       "company of partner %s.") %
                     (mandate.display_name, mandate.partner_id.name))
 
-            if self.env['account.payment.line'].search(
-                    [('mandate_id', '=', mandate.id),
-                     ('company_id', '=', mandate.company_id.id)], limit=1):
-                raise ValidationError(
-                    _("You cannot change the company of mandate %s, "
-                      "as there exists payment lines referencing it that "
-                      "belong to another company.") %
-                    (mandate.display_name, ))
-
-            if self.env['account.invoice'].search(
-                    [('mandate_id', '=', mandate.id),
-                     ('company_id', '=', mandate.company_id.id)], limit=1):
-                raise ValidationError(
-                    _("You cannot change the company of mandate %s, "
-                      "as there exists invoices referencing it that belong to "
-                      "another company.") %
-                    (mandate.display_name, ))
-
-            if self.env['account.move.line'].search(
-                    [('mandate_id', '=', mandate.id),
-                     ('company_id', '=', mandate.company_id.id)], limit=1):
-                raise ValidationError(
-                    _("You cannot change the company of mandate %s, "
-                      "as there exists journal items referencing it that "
-                      "belong to another company.") %
-                    (mandate.display_name, ))
-
-            if self.env['bank.payment.line'].search(
-                    [('mandate_id', '=', mandate.id),
-                     ('company_id', '=', mandate.company_id.id)], limit=1):
-                raise ValidationError(
-                    _("You cannot change the company of mandate %s, "
-                      "as there exists bank payment lines referencing it that "
-                      "belong to another company.") %
-                    (mandate.display_name, ))
+    @api.multi
+    def _check_company_references(self):
+        """Check that the documents referencing the mandates belong to
+        their company, with one query for all the mandates. Called by
+        write() when the company of mandates changes, as a new mandate
+        cannot be referenced yet"""
+        if not self:
+            return
+        self._cr.execute("""
+            SELECT abm.id,
+            EXISTS(
+                SELECT 1 FROM account_payment_line apl
+                WHERE apl.mandate_id = abm.id
+                AND apl.company_id != abm.company_id),
+            EXISTS(
+                SELECT 1 FROM account_invoice ai
+                WHERE ai.mandate_id = abm.id
+                AND ai.company_id != abm.company_id),
+            EXISTS(
+                SELECT 1 FROM account_move_line aml
+                WHERE aml.mandate_id = abm.id
+                AND aml.company_id != abm.company_id),
+            EXISTS(
+                SELECT 1 FROM account_payment_line apl
+                JOIN bank_payment_line bpl ON bpl.id = apl.bank_line_id
+                WHERE apl.mandate_id = abm.id
+                AND bpl.company_id != abm.company_id)
+            FROM account_banking_mandate abm
+            WHERE abm.id IN %s
+            """, (tuple(self.ids), ))
+        messages = [
+            _("You cannot change the company of mandate %s, "
+              "as there exists payment lines referencing it that "
+              "belong to another company."),
+            _("You cannot change the company of mandate %s, "
+              "as there exists invoices referencing it that belong to "
+              "another company."),
+            _("You cannot change the company of mandate %s, "
+              "as there exists journal items referencing it that "
+              "belong to another company."),
+            _("You cannot change the company of mandate %s, "
+              "as there exists bank payment lines referencing it that "
+              "belong to another company."),
+            ]
+        for row in self._cr.fetchall():
+            for message, exists in zip(messages, row[1:]):
+                if exists:
+                    raise ValidationError(
+                        message % (self.browse(row[0]).display_name, ))
+
+    @api.multi
+    def write(self, vals):
+        changed_mandates = self.browse([])
+        if vals.get('company_id'):
+            changed_mandates = self.filtered(
+                lambda x: x.company_id.id != vals['company_id'])
+        res = super(AccountBankingMandate, self).write(vals)
+        changed_mandates._check_company_references()
+        return res
 
     @api.multi
     @api.constrains('state', 'partner_bank_id')
@@ -139,6 +163,13 @@ class AccountBankingMandate(models.Model):
                           "attached to a bank account.") %
                         mandate.unique_mandate_reference)
 
+    @api.model
+    def _get_import_columns(self):
+        """Return the fields of the mandate that can be given in the CSV
+        file of the wizard account.banking.mandate.import"""
+        return ['unique_mandate_reference', 'signature_date', 'state',
+                'format', 'type']
+
     @api.model
     def create(self, vals=None):
         if vals.get('unique_mandate_reference', 'New') == 'New':
@@ -24,6 +24,9 @@ class AccountMoveLine(models.Model):
         if not mandate and vals.get('mandate_id', False):
             mandate = mandate.browse(vals['mandate_id'])
         if not mandate:
+            if self._context.get('skip_mandate_search'):
+                # The mandate is found by _prepare_payment_lines_vals()
+                return vals
             partner_bank_id = vals.get('partner_bank_id', False)
             if partner_bank_id:
                 domain = [('partner_bank_id', '=', partner_bank_id)]
@@ -37,6 +40,54 @@ class AccountMoveLine(models.Model):
         })
         return vals
 
+    @api.multi
+    def _prepare_payment_lines_vals(self, payment_order):
+        """Search the valid mandates of the move lines without mandate
+        with one query for all the move lines, instead of one search per
+        move line in _prepare_payment_line_vals()"""
+        if payment_order.payment_type != 'inbound':
+            return super(AccountMoveLine, self)._prepare_payment_lines_vals(
+                payment_order)
+        vals_list = super(
+            AccountMoveLine, self.with_context(skip_mandate_search=True)
+        )._prepare_payment_lines_vals(payment_order)
+        to_search = [vals for vals in vals_list if not vals.get('mandate_id')]
+        if not to_search:
+            return vals_list
+        partner_bank_ids = set()
+        partner_ids = set()
+        for vals in to_search:
+            if vals.get('partner_bank_id'):
+                partner_bank_ids.add(vals['partner_bank_id'])
+            else:
+                partner_ids.add(vals['partner_id'])
+        mandates = self.env['account.banking.mandate'].search([
+            ('state', '=', 'valid'),
+            '|',
+            ('partner_bank_id', 'in', list(partner_bank_ids)),
+            ('partner_id', 'in', list(partner_ids))])
+        # First valid mandate per bank account and per partner, in the
+        # order of the mandates, as the search with limit=1 does
+        mandate_per_bank = {}
+        mandate_per_partner = {}
+        for mandate in mandates:
+            mandate_per_bank.setdefault(mandate.partner_bank_id.id, mandate)
+            mandate_per_partner.setdefault(mandate.partner_id.id, mandate)
+        for vals in to_search:
+            partner_bank_id = vals.get('partner_bank_id', False)
+            if partner_bank_id:
+                mandate = mandate_per_bank.get(partner_bank_id)
+            else:
+                mandate = mandate_per_partner.get(vals['partner_id'])
+            if mandate:
+                vals.update({
+                    'mandate_id': mandate.id,
+                    'partner_bank_id': mandate.partner_bank_id.id,
+                })
+            else:
+                vals['mandate_id'] = False
+        return vals_list
+
     @api.multi
     @api.constrains('mandate_id', 'company_id')
     def _check_company_constrains(self):
@@ -4,7 +4,7 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 
 from odoo import models, fields, api, _
-from odoo.exceptions import ValidationError, UserError
+from odoo.exceptions import ValidationError
 
 
 class AccountPaymentLine(models.Model):
@@ -45,9 +45,9 @@ class AccountPaymentLine(models.Model):
                      pline.mandate_id.display_name))
 
     @api.multi
-    def draft2open_payment_line_check(self):
-        res = super(AccountPaymentLine, self).draft2open_payment_line_check()
+    def _get_draft2open_problems(self):
+        problems = super(AccountPaymentLine, self)._get_draft2open_problems()
         if self.mandate_required and not self.mandate_id:
-            raise UserError(_(
-                'Missing Mandate on payment line %s') % self.name)
-        return res
+            problems.append(('missing_mandate', _(
+                'Missing Mandate on payment line %s') % self.name))
+        return problems
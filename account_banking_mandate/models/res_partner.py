@@ -26,25 +26,47 @@ class ResPartner(models.Model):
         for partner in self:
             partner.mandate_count = mapped_data.get(partner.id, 0)
 
+    @api.model
+    def _get_valid_mandate_ids(self, commercial_partner_ids, company):
+        """Return a dict commercial partner ID -> ID of its first valid
+        mandate for the company, in the order of the bank accounts of the
+        partner then of the mandates, with one query for all the partners"""
+        self.env['account.banking.mandate'].check_access_rights('read')
+        self._cr.execute("""
+            SELECT DISTINCT ON (rpb.partner_id) rpb.partner_id, abm.id
+            FROM account_banking_mandate abm
+            JOIN res_partner_bank rpb ON rpb.id = abm.partner_bank_id
+            WHERE rpb.partner_id IN %s
+            AND abm.state = 'valid'
+            AND abm.company_id = %s
+            ORDER BY rpb.partner_id, rpb.sequence, rpb.id,
+            abm.signature_date DESC, abm.id
+            """, (tuple(commercial_partner_ids), company.id))
+        return dict(self._cr.fetchall())
+
     @api.multi
     def _compute_valid_mandate_id(self):
-        # Dict for reducing the duplicated searches on parent/child partners
         company_id = self.env.context.get('force_company', False)
         if company_id:
             company = self.env['res.company'].browse(company_id)
         else:
             company = self.env['res.company']._company_default_get(
                 'account.banking.mandate')
-
-        mandates_dic = {}
+        # The mandates of all the partners are read with one query
+        to_search = set(
+            partner.commercial_partner_id.id for partner in self
+            if isinstance(partner.commercial_partner_id.id, int))
+        mandate_ids = {}
+        if to_search:
+            mandate_ids = self._get_valid_mandate_ids(to_search, company)
         for partner in self:
-            commercial_partner_id = partner.commercial_partner_id.id
-            if commercial_partner_id in mandates_dic:
-                partner.valid_mandate_id = mandates_dic[commercial_partner_id]
-            else:
-                mandates = partner.commercial_partner_id.bank_ids.mapped(
+            commercial_partner = partner.commercial_partner_id
+            if not isinstance(commercial_partner.id, int):
+                # Partner being created in a form
+                partner.valid_mandate_id = commercial_partner.bank_ids.mapped(
                     'mandate_ids').filtered(
-                    lambda x: x.state == 'valid' and x.company_id == company)
-                first_valid_mandate_id = mandates[:1].id
-                partner.valid_mandate_id = first_valid_mandate_id
-                mandates_dic[commercial_partner_id] = first_valid_mandate_id
+                    lambda x: x.state == 'valid' and x.company_id == company
+                )[:1]
+                continue
+            partner.valid_mandate_id = mandate_ids.get(
+                commercial_partner.id, False)
@@ -59,6 +59,68 @@ class TestInvoiceMandate(TransactionCase):
             with self.assertRaises(ValidationError):
                 payable_move_lines[0].mandate_id = mandate_2
 
+    def test_prepare_payment_lines_vals(self):
+        self.invoice._onchange_partner_id()
+        self.invoice.action_invoice_open()
+        mline = self.invoice.move_id.line_ids.filtered(
+            lambda s: s.account_id == self.invoice_account)
+        mline.mandate_id = False
+        payment_order = self.env['account.payment.order'].create({
+            'payment_type': 'inbound',
+            'payment_mode_id': self.mode_inbound_acme.id,
+        })
+        vals_list = mline._prepare_payment_lines_vals(payment_order)
+        self.assertEqual(
+            vals_list, [mline._prepare_payment_line_vals(payment_order)])
+        self.assertEqual(vals_list[0]['mandate_id'], self.mandate.id)
+        self.assertEqual(
+            vals_list[0]['partner_bank_id'], self.mandate.partner_bank_id.id)
+
+    def test_valid_mandate_id(self):
+        other_partner = self.env['res.partner'].create({'name': 'No mandate'})
+        partners = self.partner + other_partner
+        partners.invalidate_cache(['valid_mandate_id'])
+        self.assertEqual(
+            partners.mapped('valid_mandate_id'), self.mandate)
+        self.assertFalse(other_partner.valid_mandate_id)
+        self.mandate.cancel()
+        self.partner.invalidate_cache(['valid_mandate_id'])
+        self.assertFalse(self.partner.valid_mandate_id)
+
+    def test_mandate_company_references(self):
+        self.invoice._onchange_partner_id()
+        self.assertEqual(self.invoice.mandate_id, self.mandate)
+        self.mandate.partner_bank_id.company_id = False
+        # Writing the same company does not check the references
+        self.mandate.company_id = self.company
+        with self.assertRaises(ValidationError):
+            self.mandate.company_id = self.company_2
+
+    def test_mandate_bank_account_company(self):
+        bank_account_2 = self.env['res.partner.bank'].create({
+            'acc_number': '0023032234211124',
+            'partner_id': self.partner.id,
+            'bank_id': self.acme_bank.id,
+            'company_id': self.company_2.id,
+        })
+        with self.assertRaises(ValidationError):
+            self.mandate.partner_bank_id = bank_account_2
+        # The invoice of the current company references the mandate
+        self.assertEqual(self.invoice.mandate_id, self.mandate)
+        with self.assertRaises(ValidationError):
+            self.mandate.write({
+                'partner_bank_id': bank_account_2.id,
+                'company_id': self.company_2.id,
+            })
+        # Without any document of another company, the mandate can follow
+        # its bank account
+        self.invoice.mandate_id = False
+        self.mandate.write({
+            'partner_bank_id': bank_account_2.id,
+            'company_id': self.company_2.id,
+        })
+        self.assertEqual(self.mandate.company_id, self.company_2)
+
     def test_post_invoice_and_refund_02(self):
         self.invoice._onchange_partner_id()
         self.invoice.action_invoice_open()
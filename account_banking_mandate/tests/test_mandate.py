@@ -1,6 +1,7 @@
 # © 2016 Akretion (Alexis de Lattre <alexis.delattre@akretion.com>)
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 
+import base64
 from odoo.tests.common import TransactionCase
 from odoo import fields
 from odoo.exceptions import UserError, ValidationError
@@ -124,6 +125,54 @@ class TestMandate(TransactionCase):
         with self.assertRaises(ValidationError):
             bank_account_2.mandate_ids += mandate
 
+    def test_import_mandates(self):
+        bank_account = self.env.ref('account_payment_mode.res_partner_12_iban')
+        partner = self.env.ref('base.res_partner_2')
+        partner.ref = 'MANDIMP'
+        self.env['res.partner'].create({'name': 'Dup 1', 'ref': 'MANDDUP'})
+        self.env['res.partner'].create({'name': 'Dup 2', 'ref': 'MANDDUP'})
+        csv_data = '\n'.join([
+            'iban,partner_ref,unique_mandate_reference,signature_date,state',
+            '%s,,MANDIMP-1,2015-01-01,valid' % bank_account.acc_number,
+            'FR76 3000 4000 0312 3456 7890 143,MANDIMP,MANDIMP-2,,draft',
+            'FR7630004000031234567890143,MANDIMP,MANDIMP-3,2015-01-01,',
+            'FR7630004000039999999999999,,MANDIMP-4,2015-01-01,valid',
+            '%s,,MANDIMP-5,,valid' % bank_account.acc_number,
+            # The bank account belongs to another partner
+            '%s,MANDIMP,MANDIMP-6,,draft' % bank_account.acc_number,
+            # Several partners have the reference
+            'FR7630004000038888888888888,MANDDUP,MANDIMP-7,,draft',
+            ])
+        wizard = self.env['account.banking.mandate.import'].create({
+            'data_file': base64.b64encode(csv_data.encode('utf-8')),
+            'filename': 'mandates.csv',
+            'company_id': self.company.id,
+        })
+        wizard.import_mandates()
+        self.assertEqual(wizard.state, 'done')
+        self.assertEqual(wizard.created_count, 3)
+        self.assertEqual(wizard.reject_count, 4)
+        mandates = self.env['account.banking.mandate'].search([
+            ('unique_mandate_reference', 'like', 'MANDIMP-')])
+        self.assertEqual(len(mandates), 3)
+        self.assertEqual(
+            mandates.filtered(
+                lambda x: x.unique_mandate_reference == 'MANDIMP-1'
+            ).partner_bank_id, bank_account)
+        new_banks = mandates.mapped('partner_bank_id') - bank_account
+        self.assertEqual(len(new_banks), 1)
+        self.assertEqual(new_banks.partner_id, partner)
+        rejects = base64.b64decode(wizard.reject_file).decode(
+            'utf-8').splitlines()
+        self.assertEqual(len(rejects), 5)
+        self.assertTrue(rejects[0].endswith(',error'))
+        self.assertIn('MANDIMP-4', rejects[1])
+        self.assertIn('MANDIMP-5', rejects[2])
+        self.assertIn('MANDIMP-6', rejects[3])
+        self.assertIn('does not belong to the partner', rejects[3])
+        self.assertIn('MANDIMP-7', rejects[4])
+        self.assertIn('Several partners', rejects[4])
+
     def setUp(self):
         res = super(TestMandate, self).setUp()
         # Company
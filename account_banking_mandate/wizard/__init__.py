@@ -0,0 +1 @@
+from . import account_banking_mandate_import
@@ -0,0 +1,334 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+import base64
+import csv
+import io
+import logging
+from itertools import islice
+
+from odoo import models, fields, api, _
+from odoo.addons.base.res.res_bank import sanitize_account_number
+from odoo.exceptions import UserError
+
+logger = logging.getLogger(__name__)
+
+# Number of CSV rows validated and created together
+IMPORT_CHUNK_SIZE = 1000
+
+
+class AccountBankingMandateImport(models.TransientModel):
+    """Import of mandates from a CSV file, typically when migrating from
+    another direct debit system.
+
+    The file has a header line. The column 'iban' is required: it gives
+    the bank account of the mandate. When no bank account has this
+    number, it is created for the partner of the column 'partner_ref'
+    (the internal reference of the partner). The other columns are
+    fields of the mandate, cf AccountBankingMandate._get_import_columns().
+    The rows are read, validated and created by chunks. The invalid rows
+    are written, with the error, in a reject file instead of stopping
+    the import.
+    """
+    _name = 'account.banking.mandate.import'
+    _description = 'Import Banking Mandates'
+
+    data_file = fields.Binary(string='CSV File', required=True)
+    filename = fields.Char(string='Filename')
+    delimiter = fields.Selection([
+        (',', 'Comma'),
+        (';', 'Semicolon'),
+        ('\t', 'Tab'),
+        ], string='Delimiter', required=True, default=',')
+    company_id = fields.Many2one(
+        'res.company', string='Company', required=True,
+        default=lambda self: self.env['res.company']._company_default_get(
+            'account.banking.mandate'))
+    state = fields.Selection([
+        ('draft', 'Draft'),
+        ('done', 'Done'),
+        ], string='State', default='draft', readonly=True)
+    created_count = fields.Integer(string='Created Mandates', readonly=True)
+    reject_count = fields.Integer(string='Rejected Lines', readonly=True)
+    reject_file = fields.Binary(string='Reject File', readonly=True)
+    reject_filename = fields.Char(string='Reject Filename', readonly=True)
+
+    @api.multi
+    def _read_rows(self):
+        """Return the header and an iterator on the rows of the CSV file,
+        parsed while they are read"""
+        self.ensure_one()
+        data = base64.b64decode(self.data_file)
+        reader = csv.DictReader(
+            io.TextIOWrapper(io.BytesIO(data), encoding='utf-8-sig'),
+            delimiter=str(self.delimiter))
+        columns = reader.fieldnames or []
+        if 'iban' not in columns:
+            raise UserError(_("The CSV file must have a column 'iban'."))
+        allowed_columns = set(
+            self.env['account.banking.mandate']._get_import_columns())
+        allowed_columns.update(['iban', 'partner_ref'])
+        unknown_columns = [
+            column for column in columns if column not in allowed_columns]
+        if unknown_columns:
+            raise UserError(_(
+                "Unknown columns in the CSV file: %s.")
+                % ', '.join(unknown_columns))
+        return columns, reader
+
+    @api.multi
+    def _get_bank_index(self, rows):
+        """Return the bank accounts of the IBANs of the rows, as a dict
+        sanitized account number -> {'id', 'partner_id', 'company_id'}"""
+        ibans = set(
+            sanitize_account_number(row['iban']) for row in rows
+            if row.get('iban'))
+        index = {}
+        if not ibans:
+            return index
+        banks = self.env['res.partner.bank'].search_read(
+            [('sanitized_acc_number', 'in', list(ibans))],
+            ['sanitized_acc_number', 'partner_id', 'company_id'])
+        for bank in banks:
+            index.setdefault(bank['sanitized_acc_number'], {
+                'id': bank['id'],
+                'partner_id': bank['partner_id'] and bank['partner_id'][0],
+                'company_id': bank['company_id'] and bank['company_id'][0],
+                })
+        return index
+
+    @api.model
+    def _get_partner_index(self, rows):
+        """Return the partners of the references of the rows, as a dict
+        reference -> partner ID, or False when several partners have the
+        reference"""
+        refs = set(
+            row['partner_ref'] for row in rows if row.get('partner_ref'))
+        index = {}
+        if not refs:
+            return index
+        for partner in self.env['res.partner'].search_read(
+                [('ref', 'in', list(refs))], ['ref']):
+            if partner['ref'] in index:
+                index[partner['ref']] = False
+            else:
+                index[partner['ref']] = partner['id']
+        return index
+
+    @api.multi
+    def _get_existing_references(self, rows):
+        refs = set(
+            row['unique_mandate_reference'] for row in rows
+            if row.get('unique_mandate_reference'))
+        if not refs:
+            return set()
+        mandates = self.env['account.banking.mandate'].search_read([
+            ('unique_mandate_reference', 'in', list(refs)),
+            ('company_id', '=', self.company_id.id)],
+            ['unique_mandate_reference'])
+        return set(
+            mandate['unique_mandate_reference'] for mandate in mandates)
+
+    @api.multi
+    def _prepare_mandate_vals(self, row, bank_index, partner_index):
+        """Return the values of the mandate of the row, or raise a
+        UserError. The mandates are checked here as by their constraints,
+        so the valid rows are created without error"""
+        self.ensure_one()
+        abmo = self.env['account.banking.mandate']
+        vals = {'company_id': self.company_id.id}
+        for column in abmo._get_import_columns():
+            value = (row.get(column) or '').strip()
+            if not value:
+                continue
+            field = abmo._fields[column]
+            if field.type == 'selection':
+                if value not in [key for key, label in field.get_values(
+                        self.env)]:
+                    raise UserError(_(
+                        "Wrong value '%s' for the column '%s'.")
+                        % (value, column))
+            elif field.type == 'date':
+                try:
+                    value = fields.Date.to_string(
+                        fields.Date.from_string(value))
+                except ValueError:
+                    raise UserError(_(
+                        "Wrong date '%s' for the column '%s', the format "
+                        "must be YYYY-MM-DD.") % (value, column))
+            vals[column] = value
+        iban = sanitize_account_number(row.get('iban') or '')
+        if not iban:
+            raise UserError(_("Missing IBAN."))
+        bank = bank_index.get(iban)
+        partner_ref = row.get('partner_ref')
+        partner_id = partner_index.get(partner_ref)
+        if partner_ref and partner_id is False:
+            raise UserError(_(
+                "Several partners have the reference '%s'.") % partner_ref)
+        if bank:
+            if partner_ref and partner_id != bank['partner_id']:
+                raise UserError(_(
+                    "The bank account %s does not belong to the partner "
+                    "with the reference '%s'.") % (iban, partner_ref))
+            vals['partner_bank_id'] = bank['id']
+        else:
+            if not partner_id:
+                raise UserError(_(
+                    "No bank account with the IBAN %s and no partner with "
+                    "the reference '%s'.") % (iban, partner_ref))
+            # The bank account is created with the mandate
+            vals['partner_bank_id'] = {
+                'acc_number': iban, 'partner_id': partner_id}
+        if (
+                bank and bank['company_id'] and
+                bank['company_id'] != self.company_id.id):
+            raise UserError(_(
+                "The bank account %s belongs to another company.") % iban)
+        today = fields.Date.context_today(self)
+        signature_date = vals.get('signature_date')
+        if signature_date and signature_date > today:
+            raise UserError(_("The date of signature is in the future."))
+        if vals.get('state', 'draft') not in ('draft', 'valid'):
+            raise UserError(_(
+                "Only draft and valid mandates can be imported."))
+        if vals.get('state') == 'valid' and not signature_date:
+            raise UserError(_(
+                "A valid mandate must have a date of signature."))
+        return vals
+
+    @api.multi
+    def _create_mandates(self, vals_list):
+        """Create the mandates of a chunk with one reservation of the
+        references and one recomputation. If a mandate cannot be created,
+        the mandates of the chunk are created one by one, so that only the
+        faulty rows are rejected.
+        Returns the list of the errors, False for the created mandates"""
+        self.ensure_one()
+        abmo = self.env['account.banking.mandate'].with_context(
+            tracking_disable=True)
+        rpbo = self.env['res.partner.bank']
+        to_name = [
+            vals for vals in vals_list
+            if vals.get('unique_mandate_reference', 'New') == 'New']
+        names = self.env['ir.sequence'].with_context(
+            force_company=self.company_id.id).next_by_code_batch(
+            'account.banking.mandate', len(to_name))
+        for vals, name in zip(to_name, names):
+            vals['unique_mandate_reference'] = name or 'New'
+
+        # Bank accounts created for the chunk, per account number, in case
+        # several mandates of the file have the same new bank account
+        created_bank_ids = {}
+
+        def create(vals):
+            vals = dict(vals)
+            if isinstance(vals['partner_bank_id'], dict):
+                bank_vals = vals['partner_bank_id']
+                if bank_vals['acc_number'] not in created_bank_ids:
+                    created_bank_ids[bank_vals['acc_number']] = rpbo.create(
+                        bank_vals).id
+                vals['partner_bank_id'] = \
+                    created_bank_ids[bank_vals['acc_number']]
+            abmo.create(vals)
+
+        # The pending recomputations are done first, as a failed creation
+        # discards them
+        abmo.recompute()
+        try:
+            with self.env.cr.savepoint():
+                with self.env.norecompute():
+                    for vals in vals_list:
+                        create(vals)
+                abmo.recompute()
+            return [False] * len(vals_list)
+        except Exception:
+            self.env.clear()
+            created_bank_ids.clear()
+        errors = []
+        for vals in vals_list:
+            bank_ids = dict(created_bank_ids)
+            try:
+                with self.env.cr.savepoint():
+                    create(vals)
+                errors.append(False)
+            except Exception as e:
+                self.env.clear()
+                created_bank_ids.clear()
+                created_bank_ids.update(bank_ids)
+                errors.append(getattr(e, 'name', False) or str(e))
+        return errors
+
+    @api.multi
+    def import_mandates(self):
+        self.ensure_one()
+        columns, reader = self._read_rows()
+        reject_file = io.StringIO()
+        reject_writer = csv.writer(reject_file, delimiter=str(self.delimiter))
+        reject_writer.writerow(columns + ['error'])
+        created_count = reject_count = 0
+        # The references already seen in the file
+        references = set()
+        while True:
+            rows = list(islice(reader, IMPORT_CHUNK_SIZE))
+            if not rows:
+                break
+            bank_index = self._get_bank_index(rows)
+            partner_index = self._get_partner_index(rows)
+            existing_references = self._get_existing_references(rows)
+            valid_rows = []
+            vals_list = []
+            for row in rows:
+                reference = row.get('unique_mandate_reference')
+                try:
+                    if reference and (
+                            reference in existing_references or
+                            reference in references):
+                        raise UserError(_(
+                            "A mandate with the reference %s already "
+                            "exists.") % reference)
+                    vals = self._prepare_mandate_vals(
+                        row, bank_index, partner_index)
+                except UserError as e:
+                    reject_writer.writerow(
+                        [row.get(column) for column in columns] + [e.name])
+                    reject_count += 1
+                    continue
+                if reference:
+                    references.add(reference)
+                valid_rows.append(row)
+                vals_list.append(vals)
+            errors = self._create_mandates(vals_list)
+            for row, error in zip(valid_rows, errors):
+                if error:
+                    reject_writer.writerow(
+                        [row.get(column) for column in columns] + [error])
+                    reject_count += 1
+                else:
+                    created_count += 1
+            # Free the cache of the mandates of the chunk
+            self.env['account.banking.mandate'].invalidate_cache()
+            logger.info(
+                'Mandate import: %d mandates created, %d lines rejected',
+                created_count, reject_count)
+        vals = {
+            'state': 'done',
+            'created_count': created_count,
+            'reject_count': reject_count,
+            'reject_file': False,
+            'reject_filename': False,
+            }
+        if reject_count:
+            vals.update({
+                'reject_file': base64.b64encode(
+                    reject_file.getvalue().encode('utf-8')),
+                'reject_filename': 'rejected_%s' % (
+                    self.filename or 'mandates.csv'),
+                })
+        self.write(vals)
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'view_mode': 'form',
+            'res_id': self.id,
+            'target': 'new',
+            }
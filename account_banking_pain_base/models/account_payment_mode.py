@@ -27,3 +27,21 @@ class AccountPaymentMode(models.Model):
         "- Country code (2, optional)\n"
         "- Company idenfier (N, VAT)\n"
         "- Service suffix (N, issued by bank)")
+    pain_stream = fields.Boolean(
+        string='Stream PAIN File',
+        help="If active, the PAIN file is written to a temporary file "
+        "while it is generated, instead of being built in memory. "
+        "Recommended for payment orders with a very large number of "
+        "transactions.")
+    pain_max_transactions = fields.Integer(
+        string='Max. Transactions per File',
+        help="If the payment order has more transactions, several PAIN "
+        "files are generated. 0 means no limit.")
+    pain_max_payment_infos = fields.Integer(
+        string='Max. Payment Info Blocks per File',
+        help="If the payment order has more payment info blocks (PmtInf), "
+        "several PAIN files are generated. 0 means no limit.")
+    pain_max_file_size = fields.Integer(
+        string='Max. File Size (KB)',
+        help="If a PAIN file is bigger, its transactions are split in "
+        "several files. 0 means no limit.")
@@ -5,10 +5,20 @@
 
 from odoo import models, fields, api, _, tools
 from odoo.exceptions import UserError
+from odoo.modules.module import get_resource_path
 from odoo.tools.safe_eval import safe_eval
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache
 from lxml import etree
 import logging
+import operator
+import os
+import re
+import threading
+
+from .pain_stream import PainStreamWriter
 
 
 try:
@@ -18,6 +28,84 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# Compiled XML schemas of the PAIN formats, shared by all the requests of
+# the worker: {(absolute path of the XSD file, mtime): etree.XMLSchema}.
+# A compiled schema can be used by several threads at the same time,
+# as lxml creates a new validation context at each validation.
+PAIN_XML_SCHEMAS = {}
+PAIN_XML_SCHEMAS_LOCK = threading.Lock()
+
+# ASCII characters that many banks refuse, cf _prepare_field()
+UNALLOWED_ASCII_CHARS = '"#$%&*;<>=@[]^_`{}|~\\!'
+ASCII_TRANSLATION_TABLE = str.maketrans(
+    dict.fromkeys(UNALLOWED_ASCII_CHARS, '-'))
+
+# Share of the max. file size of the payment mode used to estimate the
+# number of transactions per PAIN file, as the header of the file is
+# counted in the size per transaction, cf _get_payment_files()
+PAIN_FILE_SIZE_MARGIN = 0.9
+
+FIELD_PATH_RE = re.compile(r'^([a-zA-Z]\w*)((?:\.[a-zA-Z]\w*)*)$')
+
+
+def get_pain_xml_schema(xsd_path):
+    """Return the compiled XML schema of the XSD file xsd_path, from the
+    cache of the worker when the file has not changed"""
+    key = (xsd_path, os.path.getmtime(xsd_path))
+    schema = PAIN_XML_SCHEMAS.get(key)
+    if schema is None:
+        with PAIN_XML_SCHEMAS_LOCK:
+            schema = PAIN_XML_SCHEMAS.get(key)
+            if schema is None:
+                schema = etree.XMLSchema(etree.parse(xsd_path))
+                # Forget the schemas of the previous versions of the file
+                for old_key in list(PAIN_XML_SCHEMAS):
+                    if old_key[0] == xsd_path:
+                        del PAIN_XML_SCHEMAS[old_key]
+                PAIN_XML_SCHEMAS[key] = schema
+    return schema
+
+
+def _validate_pain_file(args):
+    """Validate a PAIN file against its XSD file, in a thread of
+    _validate_pain_files(). Only plain values are used, not the ORM:
+    (PAIN file as bytes, absolute path of the XSD file). lxml releases
+    the GIL while it parses and validates the file, so the threads run
+    in parallel. Returns the error message if the file is invalid,
+    False otherwise"""
+    xml_string, xsd_path = args
+    try:
+        etree.fromstring(
+            xml_string, etree.XMLParser(schema=get_pain_xml_schema(xsd_path)))
+    except Exception as e:
+        return str(e)
+    return False
+
+
+class PainValidationError(Exception):
+    """Raised to roll back the generation of several PAIN files when one
+    of them is invalid, cf AccountPaymentOrder._generate_payment_files()"""
+
+
+class PainFileTooLarge(Exception):
+    """Raised to roll back the generation of a PAIN file which exceeds the
+    maximum size of the payment mode, cf
+    AccountPaymentOrder._get_payment_files()"""
+
+
+@lru_cache(maxsize=512)
+def _get_field_accessor(field_value):
+    """Return (variable name, getter) when the expression field_value
+    is a simple path such as 'line.partner_id.name', so that it can be
+    resolved without safe_eval. Return None for other expressions."""
+    match = FIELD_PATH_RE.match(field_value)
+    if not match:
+        return None
+    name, path = match.groups()
+    if path:
+        return name, operator.attrgetter(path[1:])
+    return name, lambda value: value
+
 
 class AccountPaymentOrder(models.Model):
     _inherit = 'account.payment.order'
@@ -56,20 +144,53 @@ class AccountPaymentOrder(models.Model):
         'payment_line_ids.currency_id',
         'payment_line_ids.partner_bank_id.acc_type')
     def compute_sepa(self):
+        """The distinct currencies and bank accounts of the payment lines
+        of all the orders are read with one query, and the account type
+        is computed once per bank account, instead of browsing every
+        payment line of the orders"""
         eur = self.env.ref('base.EUR')
+        order_ids = [
+            order.id for order in self if isinstance(order.id, int)]
+        pairs_per_order = {}
+        if order_ids:
+            self._cr.execute(
+                "SELECT DISTINCT order_id, currency_id, partner_bank_id "
+                "FROM account_payment_line WHERE order_id IN %s",
+                (tuple(order_ids), ))
+            for order_id, currency_id, partner_bank_id in \
+                    self._cr.fetchall():
+                pairs_per_order.setdefault(order_id, []).append(
+                    (currency_id, partner_bank_id))
+        partner_bank_ids = set(
+            partner_bank_id for pairs in pairs_per_order.values()
+            for currency_id, partner_bank_id in pairs if partner_bank_id)
+        acc_types = {
+            partner_bank.id: partner_bank.acc_type
+            for partner_bank in self.env['res.partner.bank'].browse(
+                list(partner_bank_ids))}
         for order in self:
             sepa = True
             if order.company_partner_bank_id.acc_type != 'iban':
                 sepa = False
-            for pline in order.payment_line_ids:
-                if pline.currency_id != eur:
-                    sepa = False
-                    break
-                if pline.partner_bank_id.acc_type != 'iban':
-                    sepa = False
-                    break
+            elif not isinstance(order.id, int):
+                # The payment lines of a new order are only in the cache
+                for pline in order.payment_line_ids:
+                    if pline.currency_id != eur:
+                        sepa = False
+                        break
+                    if pline.partner_bank_id.acc_type != 'iban':
+                        sepa = False
+                        break
+            else:
+                for currency_id, partner_bank_id in pairs_per_order.get(
+                        order.id, []):
+                    if (
+                            currency_id != eur.id or
+                            acc_types.get(partner_bank_id) != 'iban'):
+                        sepa = False
+                        break
             sepa = order.compute_sepa_final_hook(sepa)
-            self.sepa = sepa
+            order.sepa = sepa
 
     @api.multi
     def compute_sepa_final_hook(self, sepa):
@@ -84,19 +205,18 @@ class AccountPaymentOrder(models.Model):
             gen_args = {}
         assert isinstance(eval_ctx, dict), 'eval_ctx must contain a dict'
         try:
-            value = safe_eval(field_value, eval_ctx)
+            accessor = _get_field_accessor(field_value)
+            if accessor and accessor[0] in eval_ctx:
+                value = accessor[1](eval_ctx[accessor[0]])
+            else:
+                value = safe_eval(field_value, eval_ctx)
             # SEPA uses XML ; XML = UTF-8 ; UTF-8 = support for all characters
             # But we are dealing with banks...
             # and many banks don't want non-ASCCI characters !
             # cf section 1.4 "Character set" of the SEPA Credit Transfer
             # Scheme Customer-to-bank guidelines
             if gen_args.get('convert_to_ascii'):
-                value = unidecode(value)
-                unallowed_ascii_chars = [
-                    '"', '#', '$', '%', '&', '*', ';', '<', '>', '=', '@',
-                    '[', ']', '^', '_', '`', '{', '}', '|', '~', '\\', '!']
-                for unallowed_ascii_char in unallowed_ascii_chars:
-                    value = value.replace(unallowed_ascii_char, '-')
+                value = unidecode(value).translate(ASCII_TRANSLATION_TABLE)
         except:
             line = eval_ctx.get('line')
             if line:
@@ -120,15 +240,34 @@ class AccountPaymentOrder(models.Model):
             value = value[0:max_size]
         return value
 
+    @api.model
+    def _get_pain_xsd_path(self, xsd_file):
+        """Return the absolute path of an XSD file given as a path in the
+        addons, as returned by get_xsd_file_path()"""
+        if os.path.isabs(xsd_file):
+            return xsd_file
+        return get_resource_path(*xsd_file.split('/'))
+
+    @api.model
+    def _get_pain_xml_schema(self, gen_args):
+        """Return the compiled XML schema of gen_args['pain_xsd_file'],
+        from the cache of the worker when the XSD file has not changed"""
+        xsd_path = self._get_pain_xsd_path(gen_args['pain_xsd_file'])
+        if not xsd_path:
+            xsd_etree_obj = etree.parse(
+                tools.file_open(gen_args['pain_xsd_file']))
+            return etree.XMLSchema(xsd_etree_obj)
+        return get_pain_xml_schema(xsd_path)
+
     @api.model
     def _validate_xml(self, xml_string, gen_args):
-        xsd_etree_obj = etree.parse(
-            tools.file_open(gen_args['pain_xsd_file']))
-        official_pain_schema = etree.XMLSchema(xsd_etree_obj)
+        """Validate the serialized PAIN file while it is parsed, with the
+        compiled schema from the cache of the worker"""
+        official_pain_schema = self._get_pain_xml_schema(gen_args)
 
         try:
-            root_to_validate = etree.fromstring(xml_string)
-            official_pain_schema.assertValid(root_to_validate)
+            etree.fromstring(
+                xml_string, etree.XMLParser(schema=official_pain_schema))
         except Exception as e:
             logger.warning(
                 "The XML file is invalid against the XML Schema Definition")
@@ -143,20 +282,283 @@ class AccountPaymentOrder(models.Model):
                 % str(e))
         return True
 
+    @api.model
+    def _validate_xml_file(self, xml_file, gen_args):
+        """Validate a streamed PAIN file: the file is validated while it is
+        parsed incrementally, without building the tree of the whole file"""
+        official_pain_schema = self._get_pain_xml_schema(gen_args)
+        try:
+            for event, node in etree.iterparse(
+                    xml_file, events=('end', ), schema=official_pain_schema):
+                node.clear()
+                while node.getprevious() is not None:
+                    del node.getparent()[0]
+        except Exception as e:
+            logger.warning(
+                "The XML file is invalid against the XML Schema Definition")
+            logger.warning(e)
+            raise UserError(
+                _("The generated XML file is not valid against the official "
+                    "XML Schema Definition. The full error has been written "
+                    "in the server logs. Here is the error, which may give "
+                    "you an idea on the cause of the problem : %s")
+                % str(e))
+        return True
+
+    @api.multi
+    def _pain_stream_start(self, xml_root, gen_args):
+        """If it is enabled on the payment mode, the PAIN file is written
+        to a temporary file while it is generated, cf PainStreamWriter"""
+        self.ensure_one()
+        if self.payment_mode_id.pain_stream:
+            gen_args['pain_stream'] = PainStreamWriter(xml_root)
+        return True
+
+    @api.model
+    def _pain_stream_flush(self, node, gen_args):
+        """To be called when a block of the PAIN file is complete"""
+        if gen_args.get('pain_stream'):
+            gen_args['pain_stream'].flush(node)
+        return True
+
     @api.multi
     def finalize_sepa_file_creation(self, xml_root, gen_args):
-        xml_string = etree.tostring(
-            xml_root, pretty_print=True, encoding='UTF-8',
-            xml_declaration=True)
-        logger.debug(
-            "Generated SEPA XML file in format %s below"
-            % gen_args['pain_flavor'])
-        logger.debug(xml_string)
-        self._validate_xml(xml_string, gen_args)
-
-        filename = '%s%s.xml' % (gen_args['file_prefix'], self.name)
+        if gen_args.get('pain_stream'):
+            xml_file = gen_args['pain_stream'].finish()
+            logger.debug(
+                "Generated SEPA XML file in format %s in a temporary file"
+                % gen_args['pain_flavor'])
+            # With pain_defer_validation in the context, the file is
+            # validated afterwards, cf _generate_payment_files()
+            if not self._context.get('pain_defer_validation'):
+                self._validate_xml_file(xml_file, gen_args)
+            xml_file.seek(0)
+            xml_string = xml_file.read()
+            xml_file.close()
+        else:
+            xml_string = etree.tostring(
+                xml_root, pretty_print=True, encoding='UTF-8',
+                xml_declaration=True)
+            if not self._context.get('pain_defer_validation'):
+                self._validate_xml(xml_string, gen_args)
+            logger.debug(
+                "Generated SEPA XML file in format %s below"
+                % gen_args['pain_flavor'])
+            logger.debug(xml_string)
+
+        filename = '%s%s%s.xml' % (
+            gen_args['file_prefix'], self.name,
+            self._context.get('pain_file_suffix', ''))
         return (xml_string, filename)
 
+    @api.multi
+    def _get_preflight_problems(self, preflight_data=None):
+        problems = super(AccountPaymentOrder, self)._get_preflight_problems(
+            preflight_data=preflight_data)
+        if not self.payment_method_id.pain_version:
+            return problems
+        # The structured communications are not grouped and are cut to
+        # the size of the tag 'Ref' of the PAIN file, which would
+        # send a wrong reference to the bank: only a warning, as the
+        # communication is truncated as before
+        for payline in self.payment_line_ids:
+            if (
+                    payline.communication_type != 'normal' and
+                    payline.communication and
+                    len(payline.communication) > 35):
+                problems.append(self._prepare_preflight_problem(
+                    'communication_too_long', _(
+                        "The structured communication '%s' of the payment "
+                        "line %s is longer than 35 characters.")
+                    % (payline.communication, payline.name), payline,
+                    blocking=False))
+        return problems
+
+    @api.multi
+    def _pain_bank_lines(self):
+        """Return the bank payment lines of the PAIN file being generated:
+        all the bank payment lines of the order, or only those of the
+        current file when the order is split, cf _get_payment_files()"""
+        self.ensure_one()
+        line_ids = self._context.get('pain_bank_line_ids')
+        if line_ids is None:
+            return self.bank_line_ids
+        return self.env['bank.payment.line'].browse(line_ids)
+
+    @api.multi
+    def _pain_payment_info_key(self, bank_line):
+        """Return the key of the payment info block (PmtInf) of the bank
+        payment line. Inherited by the modules generating PAIN files"""
+        return (bank_line.date, )
+
+    @api.multi
+    def _split_pain_bank_lines(self):
+        """Split the bank payment lines of the order in lists of IDs, one
+        per PAIN file, according to the max. number of transactions and
+        of payment info blocks per file of the payment mode"""
+        self.ensure_one()
+        max_transactions = self.payment_mode_id.pain_max_transactions
+        max_payment_infos = self.payment_mode_id.pain_max_payment_infos
+        lines_per_key = OrderedDict()
+        for line in self.bank_line_ids:
+            lines_per_key.setdefault(
+                self._pain_payment_info_key(line), []).append(line.id)
+        chunks = [[]]
+        # number of payment info blocks in the last chunk
+        payment_infos = 0
+        for line_ids in lines_per_key.values():
+            if max_payment_infos and payment_infos >= max_payment_infos:
+                chunks.append([])
+                payment_infos = 0
+            payment_infos += 1
+            for line_id in line_ids:
+                if max_transactions and len(chunks[-1]) >= max_transactions:
+                    chunks.append([])
+                    payment_infos = 1
+                chunks[-1].append(line_id)
+        return chunks
+
+    @api.multi
+    def _get_payment_files(self):
+        """Generate several PAIN files when the payment order exceeds the
+        limits of the payment mode. The files are generated one after the
+        other, each with its own message identification and control sums.
+        A file bigger than the max. file size is rolled back, the number of
+        transactions per file is estimated from its size, and its
+        transactions are split on this estimate. If a file sized on the
+        estimate is still too big, its transactions are split in two
+        files"""
+        self.ensure_one()
+        mode = self.payment_mode_id
+        if not self.payment_method_id.pain_version or not (
+                mode.pain_max_transactions or
+                mode.pain_max_payment_infos or
+                mode.pain_max_file_size):
+            return super(AccountPaymentOrder, self)._get_payment_files()
+        max_size = mode.pain_max_file_size * 1024
+        chunks = self._split_pain_bank_lines()
+        split = len(chunks) > 1
+        pending = list(reversed(chunks))
+        order = self.with_context(pain_split=True)
+        files = []
+        # Max. number of transactions per file, estimated from the size of
+        # the first file that was too big
+        max_lines = 0
+        while pending:
+            line_ids = pending.pop()
+            if max_lines and len(line_ids) > max_lines:
+                split = True
+                pending += reversed([
+                    line_ids[start:start + max_lines]
+                    for start in range(0, len(line_ids), max_lines)])
+                continue
+            suffix = split and '-%d' % (len(files) + 1) or ''
+            try:
+                with self.env.cr.savepoint():
+                    payment_file = order.with_context(
+                        pain_bank_line_ids=line_ids,
+                        pain_file_suffix=suffix).generate_payment_file()
+                    file_size = len(payment_file[0])
+                    if (
+                            max_size and len(line_ids) > 1 and
+                            file_size > max_size):
+                        raise PainFileTooLarge()
+            except PainFileTooLarge:
+                self.env.invalidate_all()
+                split = True
+                if not max_lines:
+                    max_lines = max(1, int(
+                        max_size * PAIN_FILE_SIZE_MARGIN * len(line_ids) /
+                        file_size))
+                    pending.append(line_ids)
+                else:
+                    # The estimate is exceeded
+                    half = len(line_ids) // 2
+                    pending.append(line_ids[half:])
+                    pending.append(line_ids[:half])
+                continue
+            files.append(payment_file)
+        order._pain_split_files_generated()
+        return files
+
+    @api.multi
+    def _preview_payment_files(self, bank_lines):
+        """The preview generates a single PAIN file, even if the payment
+        mode splits the files: an oversized file is rolled back by
+        invalidating the whole cache, which holds the preview"""
+        files = super(AccountPaymentOrder, self)._preview_payment_files(
+            bank_lines)
+        if not self.payment_method_id.pain_version:
+            return files
+        payment_file = self.with_context(
+            pain_preview=True,
+            pain_bank_line_ids=bank_lines.ids).generate_payment_file()
+        return files + [payment_file]
+
+    @api.multi
+    def _pain_split_files_generated(self):
+        """Called once all the PAIN files of a split payment order are
+        generated, cf _get_payment_files(). Designed to be inherited"""
+        return True
+
+    @api.multi
+    def _generate_payment_files(self):
+        """The PAIN files are built one after the other, as they need the
+        ORM, which can't be shared between threads. Their validation
+        against the XSD, which is as costly as their generation for big
+        files, is then done in parallel by a pool of threads on the
+        serialized files. If a file is invalid, the files are generated
+        again one by one with the validation, so that the errors are
+        reported on the orders and only the changes of the valid orders
+        are kept"""
+        if self._context.get('pain_defer_validation'):
+            return super(AccountPaymentOrder, self)._generate_payment_files()
+        xsd_paths = {}
+        try:
+            for order in self.filtered(
+                    lambda x: x.payment_method_id.pain_version):
+                xsd_paths[order.id] = self._get_pain_xsd_path(
+                    order.payment_method_id.get_xsd_file_path())
+        except UserError:
+            xsd_paths = {}
+        if not xsd_paths or not all(xsd_paths.values()):
+            return super(AccountPaymentOrder, self)._generate_payment_files()
+        try:
+            with self.env.cr.savepoint():
+                files, errors = super(
+                    AccountPaymentOrder,
+                    self.with_context(pain_defer_validation=True)
+                )._generate_payment_files()
+                to_validate = [
+                    (order_id, (payment_file[0], xsd_path))
+                    for order_id, xsd_path in xsd_paths.items()
+                    for payment_file in files.get(order_id, [])]
+                results = self._validate_pain_files(
+                    [args for order_id, args in to_validate])
+                invalid_ids = list(set(
+                    order_id for (order_id, args), error
+                    in zip(to_validate, results) if error))
+                if invalid_ids:
+                    raise PainValidationError(invalid_ids)
+        except PainValidationError as e:
+            self.env.invalidate_all()
+            logger.info(
+                "Invalid PAIN files for the payment orders with IDs %s, "
+                "generating the files again one by one", e.args[0])
+            return super(AccountPaymentOrder, self)._generate_payment_files()
+        return files, errors
+
+    @api.model
+    def _validate_pain_files(self, args_list):
+        """Validate several PAIN files in a pool of threads.
+        args_list is a list of (PAIN file as bytes, path of the XSD file).
+        Returns the list of the error messages, False for the valid files"""
+        workers = min(len(args_list), os.cpu_count() or 1)
+        if workers < 2:
+            return [_validate_pain_file(args) for args in args_list]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(_validate_pain_file, args_list))
+
     @api.multi
     def generate_pain_nsmap(self):
         self.ensure_one()
@@ -179,8 +581,10 @@ class AccountPaymentOrder(models.Model):
             group_header, 'MsgId')
         message_identification.text = self._prepare_field(
             'Message Identification',
-            'self.name',
-            {'self': self}, 35, gen_args=gen_args)
+            'self.name + suffix', {
+                'self': self,
+                'suffix': self._context.get('pain_file_suffix', ''),
+            }, 35, gen_args=gen_args)
         creation_date_time = etree.SubElement(group_header, 'CreDtTm')
         creation_date_time.text = datetime.strftime(
             datetime.today(), '%Y-%m-%dT%H:%M:%S')
@@ -360,6 +764,46 @@ class AccountPaymentOrder(models.Model):
             party_account_other_id.text = partner_bank.sanitized_acc_number
         return True
 
+    @api.model
+    def _prepare_party_values(self, party_type, partner_bank, gen_args):
+        """Return the name and address of the party of the bank account
+        partner_bank, as written in the PAIN file. The values are computed
+        once per bank account and party type for the whole file, as the
+        same bank account is often used by many transactions"""
+        cache = gen_args.setdefault('party_values', {})
+        key = (partner_bank.id, party_type)
+        if key in cache:
+            return cache[key]
+        if party_type == 'Cdtr':
+            party_type_label = 'Creditor'
+        elif party_type == 'Dbtr':
+            party_type_label = 'Debtor'
+        name = 'partner_bank.partner_id.name'
+        eval_ctx = {'partner_bank': partner_bank}
+        party_vals = {
+            'name': self._prepare_field(
+                '%s Name' % party_type_label, name, eval_ctx,
+                gen_args.get('name_maxsize'), gen_args=gen_args),
+            'country': False,
+            'street': False,
+            'zip_city': False,
+        }
+        partner = partner_bank.partner_id
+        if partner.country_id:
+            party_vals['country'] = self._prepare_field(
+                'Country', 'partner.country_id.code',
+                {'partner': partner}, 2, gen_args=gen_args)
+            if partner.street:
+                party_vals['street'] = self._prepare_field(
+                    'Adress Line1', 'partner.street',
+                    {'partner': partner}, 70, gen_args=gen_args)
+            if partner.city and partner.zip:
+                party_vals['zip_city'] = self._prepare_field(
+                    'Address Line2', "partner.zip + ' ' + partner.city",
+                    {'partner': partner}, 70, gen_args=gen_args)
+        cache[key] = party_vals
+        return party_vals
+
     @api.model
     def generate_party_block(
             self, parent_node, party_type, order, partner_bank, gen_args,
@@ -369,15 +813,8 @@ class AccountPaymentOrder(models.Model):
         In some localization (l10n_ch_sepa for example), they need the
         bank_line argument"""
         assert order in ('B', 'C'), "Order can be 'B' or 'C'"
-        if party_type == 'Cdtr':
-            party_type_label = 'Creditor'
-        elif party_type == 'Dbtr':
-            party_type_label = 'Debtor'
-        name = 'partner_bank.partner_id.name'
-        eval_ctx = {'partner_bank': partner_bank}
-        party_name = self._prepare_field(
-            '%s Name' % party_type_label, name, eval_ctx,
-            gen_args.get('name_maxsize'), gen_args=gen_args)
+        party_vals = self._prepare_party_values(
+            party_type, partner_bank, gen_args)
         # At C level, the order is : BIC, Name, IBAN
         # At B level, the order is : Name, IBAN, BIC
         if order == 'C':
@@ -386,24 +823,17 @@ class AccountPaymentOrder(models.Model):
                 bank_line=bank_line)
         party = etree.SubElement(parent_node, party_type)
         party_nm = etree.SubElement(party, 'Nm')
-        party_nm.text = party_name
-        partner = partner_bank.partner_id
-        if partner.country_id:
+        party_nm.text = party_vals['name']
+        if party_vals['country']:
             postal_address = etree.SubElement(party, 'PstlAdr')
             country = etree.SubElement(postal_address, 'Ctry')
-            country.text = self._prepare_field(
-                'Country', 'partner.country_id.code',
-                {'partner': partner}, 2, gen_args=gen_args)
-            if partner.street:
+            country.text = party_vals['country']
+            if party_vals['street']:
                 adrline1 = etree.SubElement(postal_address, 'AdrLine')
-                adrline1.text = self._prepare_field(
-                    'Adress Line1', 'partner.street',
-                    {'partner': partner}, 70, gen_args=gen_args)
-            if partner.city and partner.zip:
+                adrline1.text = party_vals['street']
+            if party_vals['zip_city']:
                 adrline2 = etree.SubElement(postal_address, 'AdrLine')
-                adrline2.text = self._prepare_field(
-                    'Address Line2', "partner.zip + ' ' + partner.city",
-                    {'partner': partner}, 70, gen_args=gen_args)
+                adrline2.text = party_vals['zip_city']
 
         self.generate_party_acc_number(
             parent_node, party_type, order, partner_bank, gen_args,
@@ -0,0 +1,89 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+import tempfile
+
+from lxml import etree
+
+
+class PainStreamWriter(object):
+    """Incremental writer of a PAIN XML document.
+
+    The PAIN file is still built with etree.SubElement, but each time
+    a block is complete (typically a transaction), flush() writes it to
+    a spooled temporary file together with the pending nodes that
+    precede it in document order (group header, payment info header...)
+    and removes them from the tree. So the tree in memory never holds
+    more than the headers and the current transaction, whatever the
+    number of transactions of the payment order.
+
+    As the nodes are written in document order, the values of the
+    headers (number of transactions and control sums) must be set
+    before the first transaction of the header is flushed.
+    """
+
+    def __init__(self, xml_root, max_size=4 * 1024 * 1024):
+        self.xml_root = xml_root
+        self.file = tempfile.SpooledTemporaryFile(max_size=max_size)
+        self._xmlfile = etree.xmlfile(self.file, encoding='UTF-8')
+        self._writer = self._xmlfile.__enter__()
+        self._writer.write_declaration()
+        # Stack of the (node, context manager) of the open tags
+        self._open_nodes = []
+
+    def _open(self, node):
+        if node.getparent() is None:
+            context = self._writer.element(
+                node.tag, dict(node.attrib), nsmap=node.nsmap)
+        else:
+            context = self._writer.element(node.tag, dict(node.attrib))
+        context.__enter__()
+        self._open_nodes.append((node, context))
+
+    def _write(self, node):
+        # The node is detached before being written, otherwise lxml
+        # re-declares the inherited namespaces on each written node
+        node.getparent().remove(node)
+        self._writer.write(node, pretty_print=True)
+
+    def _write_children(self, parent, before=None):
+        for child in list(parent):
+            if child is before:
+                break
+            self._write(child)
+
+    def _close(self, depth):
+        while len(self._open_nodes) > depth:
+            node, context = self._open_nodes.pop()
+            self._write_children(node)
+            context.__exit__(None, None, None)
+            if node.getparent() is not None:
+                node.getparent().remove(node)
+
+    def flush(self, node):
+        """Write node and all the nodes that precede it in the document,
+        then remove them from the tree"""
+        ancestors = list(node.iterancestors())
+        ancestors.reverse()
+        depth = 0
+        while (
+                depth < len(self._open_nodes) and
+                depth < len(ancestors) and
+                self._open_nodes[depth][0] is ancestors[depth]):
+            depth += 1
+        self._close(depth)
+        for ancestor in ancestors[depth:]:
+            if ancestor.getparent() is not None:
+                self._write_children(ancestor.getparent(), before=ancestor)
+            self._open(ancestor)
+        self._write_children(node.getparent(), before=node)
+        self._write(node)
+
+    def finish(self):
+        """Write the rest of the tree and return the temporary file,
+        positioned at its beginning"""
+        if not self._open_nodes:
+            self._open(self.xml_root)
+        self._close(0)
+        self._xmlfile.__exit__(None, None, None)
+        self.file.seek(0)
+        return self.file
@@ -73,6 +73,7 @@ class AccountPaymentOrder(models.Model):
         attrib = self.generate_pain_attrib()
         xml_root = etree.Element('Document', nsmap=nsmap, attrib=attrib)
         pain_root = etree.SubElement(xml_root, root_xml_tag)
+        self._pain_stream_start(xml_root, gen_args)
         # A. Group header
         group_header, nb_of_transactions_a, control_sum_a = \
             self.generate_group_header_block(pain_root, gen_args)
@@ -81,19 +82,19 @@ class AccountPaymentOrder(models.Model):
         lines_per_group = {}
         # key = (requested_date, priority, local_instrument, categ_purpose)
         # values = list of lines as object
-        for line in self.bank_line_ids:
-            priority = line.priority
-            local_instrument = line.local_instrument
-            categ_purpose = line.category_purpose
-            # The field line.date is the requested payment date
-            # taking into account the 'date_prefered' setting
-            # cf account_banking_payment_export/models/account_payment.py
-            # in the inherit of action_open()
-            key = (line.date, priority, local_instrument, categ_purpose)
+        for line in self._pain_bank_lines():
+            key = self._pain_payment_info_key(line)
             if key in lines_per_group:
                 lines_per_group[key].append(line)
             else:
                 lines_per_group[key] = [line]
+            transactions_count_a += 1
+            amount_control_sum_a += line.amount_currency
+        # The counts and control sums are set before generating the
+        # transactions, as the headers may be streamed to the file
+        # before the transactions (cf _pain_stream_start)
+        nb_of_transactions_a.text = str(transactions_count_a)
+        control_sum_a.text = '%.2f' % amount_control_sum_a
         for (requested_date, priority, local_instrument, categ_purpose),\
                 lines in list(lines_per_group.items()):
             # B. Payment info
@@ -120,11 +121,11 @@ class AccountPaymentOrder(models.Model):
             else:
                 charge_bearer_text = self.charge_bearer
             charge_bearer.text = charge_bearer_text
-            transactions_count_b = 0
-            amount_control_sum_b = 0.0
+            if not pain_flavor.startswith('pain.001.001.02'):
+                nb_of_transactions_b.text = str(len(lines))
+                control_sum_b.text = '%.2f' % sum(
+                    line.amount_currency for line in lines)
             for line in lines:
-                transactions_count_a += 1
-                transactions_count_b += 1
                 # C. Credit Transfer Transaction Info
                 credit_transfer_transaction_info = etree.SubElement(
                     payment_info, 'CdtTrfTxInf')
@@ -143,8 +144,6 @@ class AccountPaymentOrder(models.Model):
                 instructed_amount = etree.SubElement(
                     amount, 'InstdAmt', Ccy=currency_name)
                 instructed_amount.text = '%.2f' % line.amount_currency
-                amount_control_sum_a += line.amount_currency
-                amount_control_sum_b += line.amount_currency
                 if not line.partner_bank_id:
                     raise UserError(
                         _("Bank account is missing on the bank payment line "
@@ -155,13 +154,19 @@ class AccountPaymentOrder(models.Model):
                     'C', line.partner_bank_id, gen_args, line)
                 self.generate_remittance_info_block(
                     credit_transfer_transaction_info, line, gen_args)
-            if not pain_flavor.startswith('pain.001.001.02'):
-                nb_of_transactions_b.text = str(transactions_count_b)
-                control_sum_b.text = '%.2f' % amount_control_sum_b
-        if not pain_flavor.startswith('pain.001.001.02'):
-            nb_of_transactions_a.text = str(transactions_count_a)
-            control_sum_a.text = '%.2f' % amount_control_sum_a
-        else:
-            nb_of_transactions_a.text = str(transactions_count_a)
-            control_sum_a.text = '%.2f' % amount_control_sum_a
+                self._pain_stream_flush(
+                    credit_transfer_transaction_info, gen_args)
         return self.finalize_sepa_file_creation(xml_root, gen_args)
+
+    @api.multi
+    def _pain_payment_info_key(self, bank_line):
+        if self.payment_method_id.code != 'sepa_credit_transfer':
+            return super(AccountPaymentOrder, self)._pain_payment_info_key(
+                bank_line)
+        # The field line.date is the requested payment date
+        # taking into account the 'date_prefered' setting
+        # cf account_banking_payment_export/models/account_payment.py
+        # in the inherit of action_open()
+        return (
+            bank_line.date, bank_line.priority, bank_line.local_instrument,
+            bank_line.category_purpose)
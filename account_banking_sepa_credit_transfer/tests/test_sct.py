@@ -3,6 +3,7 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
 import base64
+from unittest import mock
 from odoo.addons.account.tests.account_test_classes import AccountingTestCase
 from odoo.exceptions import UserError
 from odoo.tools import float_compare
@@ -70,6 +71,11 @@ class TestSCT(AccountingTestCase):
         self.payment_mode.payment_method_id.pain_version = 'pain.001.001.03'
         self.check_eur_currency_sct()
 
+    def test_pain_001_03_stream(self):
+        self.payment_mode.payment_method_id.pain_version = 'pain.001.001.03'
+        self.payment_mode.pain_stream = True
+        self.check_eur_currency_sct()
+
     def test_pain_001_04(self):
         self.payment_mode.payment_method_id.pain_version = 'pain.001.001.04'
         self.check_eur_currency_sct()
@@ -82,6 +88,324 @@ class TestSCT(AccountingTestCase):
         self.payment_mode.payment_method_id.pain_version = 'pain.001.003.03'
         self.check_eur_currency_sct()
 
+    def test_xml_schema_cache(self):
+        gen_args = {
+            'pain_xsd_file':
+            self.payment_mode.payment_method_id.get_xsd_file_path()}
+        schema = self.payment_order_model._get_pain_xml_schema(gen_args)
+        self.assertIs(
+            self.payment_order_model._get_pain_xml_schema(gen_args), schema)
+
+    def test_validate_xml(self):
+        gen_args = {
+            'pain_xsd_file':
+            self.payment_mode.payment_method_id.get_xsd_file_path()}
+        xml_root = etree.Element('Document', nsmap={
+            None: 'urn:iso:std:iso:20022:tech:xsd:pain.001.001.03'})
+        etree.SubElement(xml_root, 'CstmrCdtTrfInitn')
+        with self.assertRaises(UserError):
+            self.payment_order_model._validate_xml(
+                etree.tostring(xml_root), gen_args)
+
+    def test_prepare_field(self):
+        partner = self.partner_agrolait
+        self.assertEqual(
+            self.payment_order_model._prepare_field(
+                'Name', 'partner.name', {'partner': partner}, 5),
+            partner.name[:5])
+        self.assertEqual(
+            self.payment_order_model._prepare_field(
+                'Name', "partner.name + ' ' + 'é_ü!'", {'partner': partner},
+                gen_args={'convert_to_ascii': True}),
+            partner.name + ' e-u-')
+        with self.assertRaises(UserError):
+            self.payment_order_model._prepare_field(
+                'Name', 'partner.unknown_field', {'partner': partner})
+
+    def test_party_values_cache(self):
+        partner_bank = self.env.ref('account_payment_mode.res_partner_2_iban')
+        gen_args = {'name_maxsize': 70}
+        party_vals = self.payment_order_model._prepare_party_values(
+            'Cdtr', partner_bank, gen_args)
+        self.assertEqual(party_vals['name'], partner_bank.partner_id.name)
+        self.assertIs(
+            self.payment_order_model._prepare_party_values(
+                'Cdtr', partner_bank, gen_args), party_vals)
+        self.assertIsNot(
+            self.payment_order_model._prepare_party_values(
+                'Dbtr', partner_bank, gen_args), party_vals)
+
+    def test_generate_move_per_line(self):
+        self.payment_mode.payment_method_id.pain_version = 'pain.001.001.03'
+        self.payment_mode.move_option = 'line'
+        self.check_eur_currency_sct()
+        bank_lines = self.payment_order.bank_line_ids
+        moves = self.env['account.move'].search([
+            ('payment_order_id', '=', self.payment_order.id)])
+        self.assertEqual(len(moves), len(bank_lines))
+        self.assertTrue(all(move.state == 'posted' for move in moves))
+        for bank_line in bank_lines:
+            self.assertEqual(len(bank_line.transit_move_line_ids), 1)
+            self.assertTrue(bank_line.transit_move_line_ids.reconciled)
+
+    def test_pain_split_transactions(self):
+        self.payment_mode.pain_max_transactions = 1
+        self.check_pain_split()
+
+    def test_pain_split_file_size(self):
+        self.payment_mode.pain_max_file_size = 1
+        self.check_pain_split()
+
+    def test_pain_split_file_size_estimate(self):
+        self.payment_mode.payment_method_id.pain_version = 'pain.001.001.03'
+        self.payment_mode.pain_max_file_size = 1
+        self.payment_mode.group_lines = False
+        for index in range(4):
+            invoice = self.create_invoice(
+                self.partner_agrolait.id,
+                'account_payment_mode.res_partner_2_iban',
+                self.eur_currency.id, 10.0 + index, 'F141%d' % index)
+            action = invoice.create_account_payment_line()
+        payment_order = self.payment_order_model.browse(action['res_id'])
+        payment_order.draft2open()
+        self.assertEqual(payment_order.bank_line_count, 4)
+        generate_payment_file = type(payment_order).generate_payment_file
+        line_counts = []
+
+        def counting_generate_payment_file(order):
+            line_counts.append(len(order._context['pain_bank_line_ids']))
+            return generate_payment_file(order)
+
+        with mock.patch.object(
+                type(payment_order), 'generate_payment_file',
+                counting_generate_payment_file):
+            action = payment_order.open2generated()
+        # The first file is too big, the other ones are sized on the
+        # estimate taken from it, without halving the transactions
+        self.assertEqual(line_counts, [4, 1, 1, 1, 1])
+        self.assertEqual(
+            len(self.attachment_model.search(action['domain'])), 4)
+
+    def check_pain_split(self):
+        self.payment_mode.payment_method_id.pain_version = 'pain.001.001.03'
+        invoice1 = self.create_invoice(
+            self.partner_agrolait.id,
+            'account_payment_mode.res_partner_2_iban', self.eur_currency.id,
+            42.0, 'F1351')
+        invoice2 = self.create_invoice(
+            self.partner_c2c.id,
+            'account_payment_mode.res_partner_12_iban', self.eur_currency.id,
+            11.0, 'I1652')
+        for inv in [invoice1, invoice2]:
+            action = inv.create_account_payment_line()
+        payment_order = self.payment_order_model.browse(action['res_id'])
+        payment_order.draft2open()
+        self.assertEqual(payment_order.bank_line_count, 2)
+        action = payment_order.open2generated()
+        self.assertEqual(payment_order.state, 'generated')
+        attachments = self.attachment_model.search(action['domain'])
+        self.assertEqual(len(attachments), 2)
+        msg_ids = set()
+        for attachment in attachments:
+            xml_root = etree.fromstring(base64.b64decode(attachment.datas))
+            namespaces = {'p': xml_root.nsmap[None]}
+            self.assertEqual(xml_root.xpath(
+                '//p:GrpHdr/p:NbOfTxs', namespaces=namespaces)[0].text, '1')
+            msg_ids.add(xml_root.xpath(
+                '//p:GrpHdr/p:MsgId', namespaces=namespaces)[0].text)
+        self.assertEqual(len(msg_ids), 2)
+        self.assertEqual(
+            len(set(attachments.mapped('datas_fname'))), 2)
+
+    def test_preview(self):
+        self.payment_mode.payment_method_id.pain_version = 'pain.001.001.03'
+        invoice1 = self.create_invoice(
+            self.partner_agrolait.id,
+            'account_payment_mode.res_partner_2_iban', self.eur_currency.id,
+            42.0, 'F1361')
+        invoice2 = self.create_invoice(
+            self.partner_c2c.id,
+            'account_payment_mode.res_partner_12_iban', self.eur_currency.id,
+            11.0, 'I1662')
+        for inv in [invoice1, invoice2]:
+            action = inv.create_account_payment_line()
+        payment_order = self.payment_order_model.browse(action['res_id'])
+        dates = payment_order.payment_line_ids.mapped('date')
+        preview = payment_order.get_preview()
+        self.assertEqual(preview['problems'], [])
+        self.assertEqual(len(preview['groups']), 2)
+        self.assertEqual(
+            sorted(group['amount_currency'] for group in preview['groups']),
+            [11.0, 42.0])
+        self.assertEqual(len(preview['files']), 1)
+        xml_root = etree.fromstring(preview['files'][0][0])
+        namespaces = {'p': xml_root.nsmap[None]}
+        self.assertEqual(xml_root.xpath(
+            '//p:GrpHdr/p:NbOfTxs', namespaces=namespaces)[0].text, '2')
+        # Nothing was written
+        self.assertEqual(payment_order.state, 'draft')
+        self.assertFalse(payment_order.bank_line_ids)
+        self.assertFalse(self.bank_line_model.search([
+            ('order_id', '=', payment_order.id)]))
+        self.assertEqual(payment_order.payment_line_ids.mapped('date'), dates)
+        payment_order.draft2open()
+        self.assertEqual(payment_order.bank_line_count, 2)
+
+    def test_open2generated_batch(self):
+        self.payment_mode.payment_method_id.pain_version = 'pain.001.001.03'
+        mode2 = self.payment_mode.copy()
+        invoice1 = self.create_invoice(
+            self.partner_agrolait.id,
+            'account_payment_mode.res_partner_2_iban', self.eur_currency.id,
+            42.0, 'F1391')
+        invoice2 = self.create_invoice(
+            self.partner_c2c.id,
+            'account_payment_mode.res_partner_12_iban', self.eur_currency.id,
+            11.0, 'I1691')
+        invoice2.payment_mode_id = mode2
+        orders = self.payment_order_model
+        for inv in [invoice1, invoice2]:
+            action = inv.create_account_payment_line()
+            orders |= self.payment_order_model.browse(action['res_id'])
+        self.assertEqual(len(orders), 2)
+        orders.draft2open()
+        orders.open2generated_batch()
+        self.assertEqual(orders.mapped('state'), ['generated', 'generated'])
+        attachments = self.attachment_model.search([
+            ('res_model', '=', 'account.payment.order'),
+            ('res_id', 'in', orders.ids)])
+        self.assertEqual(len(attachments), 2)
+        # The files are validated by a pool of threads
+        xsd_path = self.payment_order_model._get_pain_xsd_path(
+            self.payment_mode.payment_method_id.get_xsd_file_path())
+        xml_strings = [
+            base64.b64decode(attachment.datas) for attachment in attachments]
+        results = self.payment_order_model._validate_pain_files([
+            (xml_strings[0], xsd_path),
+            (b'<Document/>', xsd_path),
+            (xml_strings[1], xsd_path)])
+        self.assertFalse(results[0])
+        self.assertTrue(results[1])
+        self.assertFalse(results[2])
+
+    def _get_end_to_end_ids(self, action):
+        attachment = self.attachment_model.browse(action['res_id'])
+        xml_root = etree.fromstring(base64.b64decode(attachment.datas))
+        namespaces = {'p': xml_root.nsmap[None]}
+        return set(node.text for node in xml_root.xpath(
+            '//p:PmtId/p:EndToEndId', namespaces=namespaces))
+
+    def test_cancel_uploaded_order(self):
+        self.payment_mode.payment_method_id.pain_version = 'pain.001.001.03'
+        invoice1 = self.create_invoice(
+            self.partner_agrolait.id,
+            'account_payment_mode.res_partner_2_iban', self.eur_currency.id,
+            42.0, 'F1401')
+        invoice2 = self.create_invoice(
+            self.partner_c2c.id,
+            'account_payment_mode.res_partner_12_iban', self.eur_currency.id,
+            11.0, 'I1701')
+        for inv in [invoice1, invoice2]:
+            action = inv.create_account_payment_line()
+        payment_order = self.payment_order_model.browse(action['res_id'])
+        payment_order.draft2open()
+        end_to_end_ids = self._get_end_to_end_ids(
+            payment_order.open2generated())
+        self.assertEqual(len(end_to_end_ids), 2)
+        payment_order.generated2uploaded()
+        bank_lines = payment_order.bank_line_ids
+        payment_order.action_done_cancel()
+        self.assertEqual(payment_order.state, 'cancel')
+        self.assertFalse(bank_lines.exists())
+        payment_order.cancel2draft()
+        payment_order.draft2open()
+        self.assertEqual(payment_order.bank_line_count, 2)
+        # The regenerated file has new EndToEndIds
+        new_end_to_end_ids = self._get_end_to_end_ids(
+            payment_order.open2generated())
+        self.assertEqual(len(new_end_to_end_ids), 2)
+        self.assertFalse(end_to_end_ids & new_end_to_end_ids)
+
+    def test_compute_sepa_multi_orders(self):
+        mode_usd = self.payment_mode.copy()
+        mode_non_iban = self.payment_mode.copy()
+        us_bank = self.env['res.bank'].create({
+            'name': 'US Bank',
+            'bic': 'CHASUS33',
+            'country': self.env.ref('base.us').id,
+            })
+        non_iban_bank = self.partner_bank_model.create({
+            'acc_number': '021000021123456789',
+            'bank_id': us_bank.id,
+            'partner_id': self.partner_c2c.id,
+            })
+        # SEPA: the payment lines are in EUR to IBANs
+        invoice1 = self.create_invoice(
+            self.partner_agrolait.id,
+            'account_payment_mode.res_partner_2_iban', self.eur_currency.id,
+            42.0, 'F1381')
+        # Not SEPA: a payment line in EUR and another in USD
+        invoice2 = self.create_invoice(
+            self.partner_agrolait.id,
+            'account_payment_mode.res_partner_2_iban', self.eur_currency.id,
+            12.0, 'F1382')
+        invoice3 = self.create_invoice(
+            self.partner_asus.id,
+            'account_payment_mode.res_partner_2_iban', self.usd_currency.id,
+            2042.0, 'Inv9041')
+        # Not SEPA: a payment line to an IBAN and another to an account
+        # of a bank in the USA, without IBAN
+        invoice4 = self.create_invoice(
+            self.partner_c2c.id,
+            'account_payment_mode.res_partner_12_iban', self.eur_currency.id,
+            11.0, 'I1681')
+        invoice5 = self.create_invoice(
+            self.partner_c2c.id,
+            'account_payment_mode.res_partner_12_iban', self.eur_currency.id,
+            41.0, 'I1682')
+        (invoice2 + invoice3).write({'payment_mode_id': mode_usd.id})
+        (invoice4 + invoice5).write({'payment_mode_id': mode_non_iban.id})
+        invoice5.partner_bank_id = non_iban_bank
+        orders = self.payment_order_model
+        for inv in [invoice1, invoice2, invoice3, invoice4, invoice5]:
+            action = inv.create_account_payment_line()
+            orders |= self.payment_order_model.browse(action['res_id'])
+        self.assertEqual(len(orders), 3)
+        self.assertEqual(non_iban_bank.acc_type, 'bank')
+        orders.invalidate_cache(['sepa'])
+        orders.compute_sepa()
+        sepa_per_mode = {
+            order.payment_mode_id: order.sepa for order in orders}
+        self.assertEqual(sepa_per_mode, {
+            self.payment_mode: True,
+            mode_usd: False,
+            mode_non_iban: False,
+            })
+
+    def test_preflight_warning(self):
+        self.payment_mode.payment_method_id.pain_version = 'pain.001.001.03'
+        invoice = self.create_invoice(
+            self.partner_agrolait.id,
+            'account_payment_mode.res_partner_2_iban', self.eur_currency.id,
+            42.0, 'F1371')
+        action = invoice.create_account_payment_line()
+        payment_order = self.payment_order_model.browse(action['res_id'])
+        payment_order.payment_line_ids.write({
+            'communication_type': 'ISO',
+            'communication': 'RF18539007547034RF18539007547034RF18',
+            })
+        problems = payment_order.get_preflight_problems()
+        self.assertEqual(
+            [(p['code'], p['blocking']) for p in problems],
+            [('communication_too_long', False)])
+        # The warnings are posted on the order and do not block it
+        payment_order.draft2open()
+        self.assertEqual(payment_order.state, 'open')
+        self.assertTrue(payment_order.message_ids.filtered(
+            lambda x: 'longer than 35 characters' in (x.body or '')))
+        payment_order.open2generated()
+        self.assertEqual(payment_order.state, 'generated')
+
     def check_eur_currency_sct(self):
         invoice1 = self.create_invoice(
             self.partner_agrolait.id,
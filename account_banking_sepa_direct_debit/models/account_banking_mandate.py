@@ -4,11 +4,15 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 
 from odoo import models, fields, api, exceptions, _
+from odoo.tools.sql import index_exists
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 import logging
+import threading
 
 NUMBER_OF_UNUSED_MONTHS_BEFORE_EXPIRY = 36
+# Number of mandates set to expired between two commits
+EXPIRY_CHUNK_SIZE = 1000
 
 logger = logging.getLogger(__name__)
 
@@ -82,23 +86,50 @@ class AccountBankingMandate(models.Model):
                 }
             return res
 
+    @api.model
+    def _get_import_columns(self):
+        return super(AccountBankingMandate, self)._get_import_columns() + [
+            'scheme', 'recurrent_sequence_type']
+
+    @api.model_cr_context
+    def _auto_init(self):
+        res = super(AccountBankingMandate, self)._auto_init()
+        # Used by the search of the mandates to expire, cf
+        # _sdd_mandate_set_state_to_expired()
+        index_name = 'account_banking_mandate_sdd_expiry_index'
+        if not index_exists(self._cr, index_name):
+            self._cr.execute(
+                "CREATE INDEX %s ON %s (last_debit_date, signature_date) "
+                "WHERE state = 'valid'" % (index_name, self._table))
+        return res
+
     @api.model
     def _sdd_mandate_set_state_to_expired(self):
         logger.info('Searching for SDD Mandates that must be set to Expired')
         expire_limit_date = datetime.today() + relativedelta(
             months=-NUMBER_OF_UNUSED_MONTHS_BEFORE_EXPIRY)
         expire_limit_date_str = expire_limit_date.strftime('%Y-%m-%d')
-        expired_mandates = self.search(
+        mandate_ids = self.search(
             ['|',
              ('last_debit_date', '=', False),
              ('last_debit_date', '<=', expire_limit_date_str),
              ('state', '=', 'valid'),
-             ('signature_date', '<=', expire_limit_date_str)])
-        if expired_mandates:
-            expired_mandates.write({'state': 'expired'})
+             ('signature_date', '<=', expire_limit_date_str)],
+            order='id').ids
+        # The mandates are expired by chunks, each in its own transaction,
+        # so the cron does not lock all the mandates at once. The change
+        # of state stays tracked on each mandate, only a count is logged
+        for start in range(0, len(mandate_ids), EXPIRY_CHUNK_SIZE):
+            chunk_ids = mandate_ids[start:start + EXPIRY_CHUNK_SIZE]
+            self.browse(chunk_ids).write({'state': 'expired'})
+            # The tests run in a single transaction, which must not be
+            # committed
+            if not getattr(threading.currentThread(), 'testing', False):
+                self.env.cr.commit()  # pylint: disable=invalid-commit
+            self.invalidate_cache(ids=chunk_ids)
             logger.info(
-                'The following SDD Mandate IDs has been set to expired: %s'
-                % expired_mandates.ids)
-        else:
+                '%d/%d SDD Mandates set to Expired',
+                start + len(chunk_ids), len(mandate_ids))
+        if not mandate_ids:
             logger.info('0 SDD Mandates had to be set to Expired')
         return True
@@ -57,61 +57,29 @@ class AccountPaymentOrder(models.Model):
         attrib = self.generate_pain_attrib()
         xml_root = etree.Element('Document', nsmap=nsmap, attrib=attrib)
         pain_root = etree.SubElement(xml_root, root_xml_tag)
+        self._pain_stream_start(xml_root, gen_args)
         # A. Group header
         group_header, nb_of_transactions_a, control_sum_a = \
             self.generate_group_header_block(pain_root, gen_args)
         transactions_count_a = 0
         amount_control_sum_a = 0.0
         lines_per_group = {}
-        # key = (requested_date, priority, sequence type)
+        # key = (requested_date, priority, categ_purpose, sequence type,
+        # scheme)
         # value = list of lines as objects
-        for line in self.bank_line_ids:
+        for line in self._pain_bank_lines():
             transactions_count_a += 1
-            priority = line.priority
-            categ_purpose = line.category_purpose
-            # The field line.date is the requested payment date
-            # taking into account the 'date_prefered' setting
-            # cf account_banking_payment_export/models/account_payment.py
-            # in the inherit of action_open()
-            if not line.mandate_id:
-                raise UserError(
-                    _("Missing SEPA Direct Debit mandate on the "
-                      "bank payment line with partner '%s' "
-                      "(reference '%s').")
-                    % (line.partner_id.name, line.name))
-            scheme = line.mandate_id.scheme
-            if line.mandate_id.state != 'valid':
-                raise Warning(
-                    _("The SEPA Direct Debit mandate with reference '%s' "
-                      "for partner '%s' has expired.")
-                    % (line.mandate_id.unique_mandate_reference,
-                       line.mandate_id.partner_id.name))
-            if line.mandate_id.type == 'oneoff':
-                seq_type = 'OOFF'
-                if line.mandate_id.last_debit_date:
-                    raise Warning(
-                        _("The mandate with reference '%s' for partner "
-                          "'%s' has type set to 'One-Off' and it has a "
-                          "last debit date set to '%s', so we can't use "
-                          "it.")
-                        % (line.mandate_id.unique_mandate_reference,
-                           line.mandate_id.partner_id.name,
-                           line.mandate_id.last_debit_date))
-            elif line.mandate_id.type == 'recurrent':
-                seq_type_map = {
-                    'recurring': 'RCUR',
-                    'first': 'FRST',
-                    'final': 'FNAL',
-                }
-                seq_type_label = \
-                    line.mandate_id.recurrent_sequence_type
-                assert seq_type_label is not False
-                seq_type = seq_type_map[seq_type_label]
-            key = (line.date, priority, categ_purpose, seq_type, scheme)
+            amount_control_sum_a += line.amount_currency
+            key = self._pain_payment_info_key(line)
             if key in lines_per_group:
                 lines_per_group[key].append(line)
             else:
                 lines_per_group[key] = [line]
+        # The counts and control sums are set before generating the
+        # transactions, as the headers may be streamed to the file
+        # before the transactions (cf _pain_stream_start)
+        nb_of_transactions_a.text = str(transactions_count_a)
+        control_sum_a.text = '%.2f' % amount_control_sum_a
 
         for (requested_date, priority, categ_purpose, sequence_type, scheme),\
                 lines in list(lines_per_group.items()):
@@ -147,10 +115,10 @@ class AccountPaymentOrder(models.Model):
                 'self.payment_mode_id.sepa_creditor_identifier or '
                 'self.company_id.sepa_creditor_identifier',
                 'SEPA Creditor Identifier', {'self': self}, 'SEPA', gen_args)
-            transactions_count_b = 0
-            amount_control_sum_b = 0.0
+            nb_of_transactions_b.text = str(len(lines))
+            control_sum_b.text = '%.2f' % sum(
+                line.amount_currency for line in lines)
             for line in lines:
-                transactions_count_b += 1
                 # C. Direct Debit Transaction Info
                 dd_transaction_info = etree.SubElement(
                     payment_info, 'DrctDbtTxInf')
@@ -173,8 +141,6 @@ class AccountPaymentOrder(models.Model):
                 instructed_amount = etree.SubElement(
                     dd_transaction_info, 'InstdAmt', Ccy=currency_name)
                 instructed_amount.text = '%.2f' % line.amount_currency
-                amount_control_sum_a += line.amount_currency
-                amount_control_sum_b += line.amount_currency
                 dd_transaction = etree.SubElement(
                     dd_transaction_info, 'DrctDbtTx')
                 mandate_related_info = etree.SubElement(
@@ -217,42 +183,140 @@ class AccountPaymentOrder(models.Model):
 
                 self.generate_remittance_info_block(
                     dd_transaction_info, line, gen_args)
-
-            nb_of_transactions_b.text = str(transactions_count_b)
-            control_sum_b.text = '%.2f' % amount_control_sum_b
-        nb_of_transactions_a.text = str(transactions_count_a)
-        control_sum_a.text = '%.2f' % amount_control_sum_a
+                self._pain_stream_flush(dd_transaction_info, gen_args)
 
         return self.finalize_sepa_file_creation(
             xml_root, gen_args)
 
+    @api.model
+    def _get_sdd_mandate_problem(self, mandate):
+        """Return the problem that prevents to debit the mandate, as a
+        (code, message), or None"""
+        if mandate.state != 'valid':
+            return ('expired_mandate', _(
+                "The SEPA Direct Debit mandate with reference '%s' "
+                "for partner '%s' has expired.")
+                % (mandate.unique_mandate_reference,
+                   mandate.partner_id.name))
+        if mandate.type == 'oneoff' and mandate.last_debit_date:
+            return ('used_oneoff_mandate', _(
+                "The mandate with reference '%s' for partner "
+                "'%s' has type set to 'One-Off' and it has a "
+                "last debit date set to '%s', so we can't use "
+                "it.")
+                % (mandate.unique_mandate_reference,
+                   mandate.partner_id.name,
+                   mandate.last_debit_date))
+        return None
+
+    @api.multi
+    def _get_preflight_problems(self, preflight_data=None):
+        problems = super(AccountPaymentOrder, self)._get_preflight_problems(
+            preflight_data=preflight_data)
+        if self.payment_method_id.code != 'sepa_direct_debit':
+            return problems
+        paylines = self.payment_line_ids
+        # Read the mandates of all the lines at once
+        paylines.mapped('mandate_id.partner_id')
+        problem_per_mandate = {}
+        for payline in paylines:
+            mandate = payline.mandate_id
+            if not mandate:
+                # Reported by the check of the payment line
+                continue
+            if mandate not in problem_per_mandate:
+                problem_per_mandate[mandate] = \
+                    self._get_sdd_mandate_problem(mandate)
+            problem = problem_per_mandate[mandate]
+            # Only a warning: the mandate may be renewed before the
+            # generation of the file, which still blocks on it
+            if problem:
+                problems.append(self._prepare_preflight_problem(
+                    problem[0], problem[1], payline, blocking=False))
+        return problems
+
+    @api.multi
+    def _pain_payment_info_key(self, bank_line):
+        if self.payment_method_id.code != 'sepa_direct_debit':
+            return super(AccountPaymentOrder, self)._pain_payment_info_key(
+                bank_line)
+        line = bank_line
+        # The field line.date is the requested payment date
+        # taking into account the 'date_prefered' setting
+        # cf account_banking_payment_export/models/account_payment.py
+        # in the inherit of action_open()
+        if not line.mandate_id:
+            raise UserError(
+                _("Missing SEPA Direct Debit mandate on the "
+                  "bank payment line with partner '%s' "
+                  "(reference '%s').")
+                % (line.partner_id.name, line.name))
+        problem = self._get_sdd_mandate_problem(line.mandate_id)
+        if problem:
+            raise UserError(problem[1])
+        scheme = line.mandate_id.scheme
+        if line.mandate_id.type == 'oneoff':
+            seq_type = 'OOFF'
+        elif line.mandate_id.type == 'recurrent':
+            seq_type_map = {
+                'recurring': 'RCUR',
+                'first': 'FRST',
+                'final': 'FNAL',
+            }
+            seq_type_label = \
+                line.mandate_id.recurrent_sequence_type
+            assert seq_type_label is not False
+            seq_type = seq_type_map[seq_type_label]
+        return (
+            line.date, line.priority, line.category_purpose, seq_type,
+            scheme)
+
     @api.multi
     def finalize_sepa_file_creation(self, xml_root, gen_args):
         """Save the SEPA Direct Debit file: mark all payments in the file
         as 'sent'. Write 'last debit date' on mandate and set oneoff
         mandate to expired.
+        When the order is split in several files, the mandates are updated
+        once all the files are generated, so that a mandate debited in
+        several files has the same sequence type in all of them.
+        The mandates are not updated by a preview, cf get_preview().
         """
-        abmo = self.env['account.banking.mandate']
-        to_expire_mandates = abmo.browse([])
-        first_mandates = abmo.browse([])
-        all_mandates = abmo.browse([])
-        for bline in self.bank_line_ids:
-            if bline.mandate_id in all_mandates:
-                continue
-            all_mandates += bline.mandate_id
-            if bline.mandate_id.type == 'oneoff':
-                to_expire_mandates += bline.mandate_id
-            elif bline.mandate_id.type == 'recurrent':
-                seq_type = bline.mandate_id.recurrent_sequence_type
-                if seq_type == 'final':
-                    to_expire_mandates += bline.mandate_id
-                elif seq_type == 'first':
-                    first_mandates += bline.mandate_id
-        all_mandates.write(
-            {'last_debit_date': fields.Date.context_today(self)})
-        to_expire_mandates.write({'state': 'expired'})
-        first_mandates.write({
-            'recurrent_sequence_type': 'recurring',
-            })
+        if not (
+                self._context.get('pain_split') or
+                self._context.get('pain_preview')):
+            self._sdd_update_mandates(self.bank_line_ids)
         return super(AccountPaymentOrder, self).finalize_sepa_file_creation(
             xml_root, gen_args)
+
+    @api.multi
+    def _pain_split_files_generated(self):
+        if self.payment_method_id.code == 'sepa_direct_debit':
+            self._sdd_update_mandates(self.bank_line_ids)
+        return super(AccountPaymentOrder, self)._pain_split_files_generated()
+
+    @api.multi
+    def _sdd_update_mandates(self, bank_lines):
+        """Write the last debit date on the mandates of the bank payment
+        lines, set the one-off and final mandates to expired and the first
+        mandates to recurring, with one write for each of these changes"""
+        mandates = bank_lines.mapped('mandate_id')
+        today = fields.Date.context_today(self)
+        to_expire_mandates = mandates.filtered(
+            lambda x: x.type == 'oneoff' or (
+                x.type == 'recurrent' and
+                x.recurrent_sequence_type == 'final'))
+        first_mandates = mandates.filtered(
+            lambda x: x.type == 'recurrent' and
+            x.recurrent_sequence_type == 'first')
+        # The last debit date is not tracked: skip the tracking of the
+        # mandates, which reads all their tracked fields before the write
+        mandates.filtered(
+            lambda x: x.last_debit_date != today
+        ).with_context(mail_notrack=True).write({'last_debit_date': today})
+        if to_expire_mandates:
+            to_expire_mandates.write({'state': 'expired'})
+        if first_mandates:
+            first_mandates.write({
+                'recurrent_sequence_type': 'recurring',
+                })
+        return True
@@ -31,8 +31,12 @@ class TestMandate(TransactionCase):
             months=-50)
         self.mandate.validate()
         self.assertEqual(self.mandate.state, 'valid')
+        messages = self.mandate.message_ids
         self.env['account.banking.mandate']._sdd_mandate_set_state_to_expired()
         self.assertEqual(self.mandate.state, 'expired')
+        # The expiry is tracked on the mandate
+        self.mandate.invalidate_cache(['message_ids'], self.mandate.ids)
+        self.assertTrue(self.mandate.message_ids - messages)
 
     def setUp(self):
         res = super(TestMandate, self).setUp()
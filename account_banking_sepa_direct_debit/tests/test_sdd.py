@@ -4,6 +4,7 @@
 
 import base64
 from odoo.addons.account.tests.account_test_classes import AccountingTestCase
+from odoo import fields
 from odoo.tools import float_compare
 import time
 from lxml import etree
@@ -64,6 +65,11 @@ class TestSDD(AccountingTestCase):
         self.payment_mode.payment_method_id.pain_version = 'pain.008.001.02'
         self.check_sdd()
 
+    def test_pain_008_001_02_stream(self):
+        self.payment_mode.payment_method_id.pain_version = 'pain.008.001.02'
+        self.payment_mode.pain_stream = True
+        self.check_sdd()
+
     def test_pain_003_02(self):
         self.payment_mode.payment_method_id.pain_version = 'pain.008.003.02'
         self.check_sdd()
@@ -76,6 +82,38 @@ class TestSDD(AccountingTestCase):
         self.payment_mode.payment_method_id.pain_version = 'pain.008.001.04'
         self.check_sdd()
 
+    def test_sdd_update_mandates(self):
+        self.payment_mode.payment_method_id.pain_version = 'pain.008.001.02'
+        first_mandate = self.env.ref(
+            'account_banking_sepa_direct_debit.res_partner_2_mandate')
+        first_mandate.recurrent_sequence_type = 'first'
+        final_mandate = self.env.ref(
+            'account_banking_sepa_direct_debit.res_partner_12_mandate')
+        final_mandate.recurrent_sequence_type = 'final'
+        invoice1 = self.create_invoice(
+            self.partner_agrolait.id,
+            'account_banking_sepa_direct_debit.res_partner_2_mandate', 42.0)
+        invoice2 = self.create_invoice(
+            self.partner_c2c.id,
+            'account_banking_sepa_direct_debit.res_partner_12_mandate', 11.0)
+        for inv in [invoice1, invoice2]:
+            action = inv.create_account_payment_line()
+        payment_order = self.payment_order_model.browse(action['res_id'])
+        payment_order.draft2open()
+        messages = final_mandate.message_ids
+        payment_order.open2generated()
+        self.assertEqual(payment_order.state, 'generated')
+        today = fields.Date.context_today(payment_order)
+        for mandate in [first_mandate, final_mandate]:
+            self.assertEqual(mandate.last_debit_date, today)
+        self.assertEqual(first_mandate.state, 'valid')
+        self.assertEqual(first_mandate.recurrent_sequence_type, 'recurring')
+        self.assertEqual(final_mandate.state, 'expired')
+        self.assertEqual(final_mandate.recurrent_sequence_type, 'final')
+        # The expiry is tracked on the mandate
+        final_mandate.invalidate_cache(['message_ids'], final_mandate.ids)
+        self.assertTrue(final_mandate.message_ids - messages)
+
     def check_sdd(self):
         self.env.ref(
             'account_banking_sepa_direct_debit.res_partner_2_mandate'
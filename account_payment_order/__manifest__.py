@@ -31,10 +31,12 @@
         'views/account_payment_order.xml',
         'views/account_payment_line.xml',
         'views/bank_payment_line.xml',
+        'views/account_payment_order_metric.xml',
         'views/account_move_line.xml',
         'views/ir_attachment.xml',
         'views/account_invoice_view.xml',
         'data/payment_seq.xml',
+        'data/payment_order_job_cron.xml',
         'report/print_account_payment_order.xml',
         'report/account_payment_order.xml',
     ],
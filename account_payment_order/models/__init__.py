@@ -1,8 +1,12 @@
 from . import account_payment_mode
 from . import account_payment_order
+from . import account_payment_order_metric
+from . import account_payment_order_job
 from . import account_payment_line
 from . import bank_payment_line
 from . import account_move
 from . import account_move_line
 from . import account_invoice
 from . import res_bank
+from . import res_currency
+from . import ir_sequence
@@ -3,6 +3,8 @@
 # © 2016 Akretion (Alexis de Lattre <alexis.delattre@akretion.com>)
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 
+from collections import OrderedDict
+
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
 
@@ -38,11 +40,7 @@ class AccountInvoice(models.Model):
         return vals
 
     @api.multi
-    def create_account_payment_line(self):
-        apoo = self.env['account.payment.order']
-        aplo = self.env['account.payment.line']
-        result_payorder_ids = []
-        action_payment_type = 'debit'
+    def _check_create_account_payment_line(self):
         for inv in self:
             if inv.state != 'open':
                 raise UserError(_(
@@ -59,55 +57,94 @@ class AccountInvoice(models.Model):
                     "which is not selectable in payment orders." % (
                         inv.number, inv.payment_mode_id.display_name))
                 )
-            payorders = apoo.search([
-                ('payment_mode_id', '=', inv.payment_mode_id.id),
-                ('state', '=', 'draft')])
-            if payorders:
-                payorder = payorders[0]
-                new_payorder = False
-            else:
+
+    @api.multi
+    def create_account_payment_line(self):
+        """Add the invoices to the draft payment order of their payment
+        mode. The draft orders of all the payment modes are read with one
+        search, and so are the existing payment lines of all the invoices.
+        The payment lines are created in one batch per payment order"""
+        apoo = self.env['account.payment.order']
+        aplo = self.env['account.payment.line']
+        amlo = self.env['account.move.line']
+        self._check_create_account_payment_line()
+        # Draft payment order of each payment mode
+        payorders = {}
+        for payorder in apoo.search([
+                ('payment_mode_id', 'in', self.mapped('payment_mode_id').ids),
+                ('state', '=', 'draft')]):
+            payorders.setdefault(payorder.payment_mode_id.id, payorder)
+        new_payorders = apoo.browse()
+        for inv in self:
+            if inv.payment_mode_id.id not in payorders:
                 payorder = apoo.create(inv._prepare_new_payment_order())
-                new_payorder = True
-            result_payorder_ids.append(payorder.id)
-            action_payment_type = payorder.payment_type
-            count = 0
-            for line in inv.move_id.line_ids:
-                if line.account_id == inv.account_id and not line.reconciled:
-                    paylines = aplo.search([
-                        ('move_line_id', '=', line.id),
-                        ('state', '!=', 'cancel')])
-                    if not paylines:
-                        line.create_payment_line_from_move_line(payorder)
-                        count += 1
-            if count:
-                if new_payorder:
-                    inv.message_post(_(
-                        '%d payment lines added to the new draft payment '
-                        'order %s which has been automatically created.')
-                        % (count, payorder.name))
-                else:
-                    inv.message_post(_(
-                        '%d payment lines added to the existing draft '
-                        'payment order %s.')
-                        % (count, payorder.name))
-            else:
+                payorders[inv.payment_mode_id.id] = payorder
+                new_payorders |= payorder
+        # Move lines to pay of each invoice, without those which already
+        # are in a payment line
+        mline_ids_per_inv = {}
+        for inv in self:
+            mline_ids_per_inv[inv.id] = inv.move_id.line_ids.filtered(
+                lambda x: x.account_id == inv.account_id and
+                not x.reconciled).ids
+        all_mline_ids = [
+            mline_id for mline_ids in mline_ids_per_inv.values()
+            for mline_id in mline_ids]
+        paid_mline_ids = set()
+        if all_mline_ids:
+            paylines = aplo.search([
+                ('move_line_id', 'in', all_mline_ids),
+                ('state', '!=', 'cancel')])
+            paid_mline_ids = set(paylines.mapped('move_line_id').ids)
+        mline_ids_per_order = OrderedDict()
+        counts = {}
+        for inv in self:
+            mline_ids = [
+                mline_id for mline_id in mline_ids_per_inv[inv.id]
+                if mline_id not in paid_mline_ids]
+            if not mline_ids:
                 raise UserError(_(
                     'No Payment Line created for invoice %s because '
                     'it already exists or because this invoice is '
                     'already paid.') % inv.number)
+            payorder = payorders[inv.payment_mode_id.id]
+            mline_ids_per_order.setdefault(payorder, []).extend(mline_ids)
+            counts[inv.id] = len(mline_ids)
+        for payorder, mline_ids in mline_ids_per_order.items():
+            amlo.browse(mline_ids).create_payment_line_from_move_line(
+                payorder)
+        self._post_payment_line_messages(counts, payorders, new_payorders)
+        result_payorders = apoo.concat(*mline_ids_per_order.keys())
+        action_payment_type = result_payorders[-1:].payment_type or 'debit'
         action = self.env['ir.actions.act_window'].for_xml_id(
             'account_payment_order',
             'account_payment_order_%s_action' % action_payment_type)
-        if len(result_payorder_ids) == 1:
+        if len(result_payorders) == 1:
             action.update({
                 'view_mode': 'form,tree,pivot,graph',
-                'res_id': payorder.id,
+                'res_id': result_payorders.id,
                 'views': False,
                 })
         else:
             action.update({
                 'view_mode': 'tree,form,pivot,graph',
-                'domain': "[('id', 'in', %s)]" % result_payorder_ids,
+                'domain': "[('id', 'in', %s)]" % result_payorders.ids,
                 'views': False,
                 })
         return action
+
+    @api.multi
+    def _post_payment_line_messages(self, counts, payorders, new_payorders):
+        """Post on each invoice the number of payment lines added to the
+        payment order, once all the payment lines are created. The
+        messages are translated once for all the invoices"""
+        new_msg = _(
+            '%d payment lines added to the new draft payment '
+            'order %s which has been automatically created.')
+        existing_msg = _(
+            '%d payment lines added to the existing draft '
+            'payment order %s.')
+        for inv in self:
+            payorder = payorders[inv.payment_mode_id.id]
+            msg = payorder in new_payorders and new_msg or existing_msg
+            inv.message_post(msg % (counts[inv.id], payorder.name))
@@ -3,7 +3,8 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 
 from lxml import etree
-from odoo import models, fields, api
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
 from odoo.osv import orm
 
 
@@ -16,6 +17,47 @@ class AccountMoveLine(models.Model):
     bank_payment_line_id = fields.Many2one(
         'bank.payment.line', string='Bank Payment Line',
         readonly=True)
+    in_pending_payment_order = fields.Boolean(
+        compute='_compute_in_pending_payment_order',
+        search='_search_in_pending_payment_order',
+        string='In a Pending Payment Order',
+        help="Technical field: the journal item is attached to a payment "
+        "line of a draft, confirmed or generated payment order.")
+
+    @api.model
+    def _pending_payment_line_query(self):
+        return (
+            "SELECT move_line_id FROM account_payment_line "
+            "WHERE state IN ('draft', 'open', 'generated') "
+            "AND move_line_id IS NOT NULL")
+
+    @api.multi
+    def _compute_in_pending_payment_order(self):
+        ids = [mline.id for mline in self if isinstance(mline.id, int)]
+        pending_ids = set()
+        if ids:
+            self._cr.execute(
+                self._pending_payment_line_query() +
+                " AND move_line_id IN %s", (tuple(ids), ))
+            pending_ids = set(row[0] for row in self._cr.fetchall())
+        for mline in self:
+            mline.in_pending_payment_order = mline.id in pending_ids
+
+    @api.model
+    def _search_in_pending_payment_order(self, operator, value):
+        if operator not in ('=', '!='):
+            raise UserError(_(
+                "Unsupported operator '%s' for searching on field "
+                "'In a Pending Payment Order'.") % operator)
+        if (operator == '=') == bool(value):
+            sql_operator = 'inselect'
+        else:
+            # NOT IN over the pending payment lines, without NULL: it is
+            # run as a filter on a hashed list of the pending journal
+            # items, which are few compared to all the journal items
+            sql_operator = 'not inselect'
+        return [('id', sql_operator, (
+            self._pending_payment_line_query(), []))]
 
     @api.multi
     def _prepare_payment_line_vals(self, payment_order):
@@ -68,12 +110,23 @@ class AccountMoveLine(models.Model):
             }
         return vals
 
+    @api.multi
+    def _prepare_payment_lines_vals(self, payment_order):
+        """Return the list of the values of the payment lines of the
+        move lines of self. The invoices, moves and partners are read
+        for all the move lines at once before the per-line preparation"""
+        self.mapped('invoice_id')
+        self.mapped('move_id')
+        self.mapped('partner_id.bank_ids')
+        return [
+            mline._prepare_payment_line_vals(payment_order)
+            for mline in self]
+
     @api.multi
     def create_payment_line_from_move_line(self, payment_order):
         aplo = self.env['account.payment.line']
-        for mline in self:
-            aplo.create(mline._prepare_payment_line_vals(payment_order))
-        return
+        return aplo._create_batch(
+            self._prepare_payment_lines_vals(payment_order))
 
     @api.model
     def fields_view_get(self, view_id=None, view_type='form', toolbar=False,
@@ -3,6 +3,7 @@
 
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
+from odoo.tools.sql import create_index
 
 
 class AccountPaymentLine(models.Model):
@@ -65,6 +66,16 @@ class AccountPaymentLine(models.Model):
         'in the same company!'
         )]
 
+    @api.model_cr_context
+    def _auto_init(self):
+        res = super(AccountPaymentLine, self)._auto_init()
+        # Used to exclude the journal items already in a payment order
+        # in the wizard account.payment.line.create
+        create_index(
+            self._cr, 'account_payment_line_move_line_id_state_index',
+            self._table, ['move_line_id', 'state'])
+        return res
+
     @api.model
     def create(self, vals):
         if vals.get('name', 'New') == 'New':
@@ -72,23 +83,41 @@ class AccountPaymentLine(models.Model):
                 'account.payment.line') or 'New'
         return super(AccountPaymentLine, self).create(vals)
 
+    @api.model
+    def _create_batch(self, vals_list):
+        """Create several payment lines at once, cf
+        IrSequence.create_batch_by_code()"""
+        return self.env['ir.sequence'].create_batch_by_code(
+            self, 'account.payment.line', vals_list)
+
     @api.multi
     @api.depends(
         'amount_currency', 'currency_id', 'company_currency_id', 'date')
     def _compute_amount_company_currency(self):
-        for line in self:
-            if line.currency_id and line.company_currency_id:
-                line.amount_company_currency = line.currency_id.with_context(
-                    date=line.date).compute(
-                        line.amount_currency, line.company_currency_id)
+        lines = self.filtered(
+            lambda x: x.currency_id and x.company_currency_id)
+        rates = self.env['res.currency']._get_payment_conversion_rates(
+            (line.currency_id, line.company_currency_id, line.date)
+            for line in lines)
+        for line in lines:
+            rate = rates[
+                (line.currency_id, line.company_currency_id, line.date)]
+            line.amount_company_currency = line.currency_id._payment_convert(
+                line.amount_currency, line.company_currency_id, rate)
 
     @api.multi
     def payment_line_hashcode(self):
         self.ensure_one()
         bplo = self.env['bank.payment.line']
         values = []
+        # Requested payment date that is not written yet on the line,
+        # cf AccountPaymentOrder.get_preflight_problems()
+        requested_date = self._context.get('payment_line_requested_date')
         for field in bplo.same_fields_payment_line_and_bank_payment_line():
-            values.append(str(self[field]))
+            if field == 'date' and requested_date:
+                values.append(str(requested_date))
+            else:
+                values.append(str(self[field]))
         # Don't group the payment lines that are attached to the same supplier
         # but to move lines with different accounts (very unlikely),
         # for easier generation/comprehension of the transfer move
@@ -130,8 +159,21 @@ class AccountPaymentLine(models.Model):
         return res
 
     @api.multi
-    def draft2open_payment_line_check(self):
+    def _get_draft2open_problems(self):
+        """Return the problems of the payment line that block the
+        confirmation of the order, as a list of (code, message).
+        Designed to be inherited"""
         self.ensure_one()
+        problems = []
         if self.bank_account_required and not self.partner_bank_id:
-            raise UserError(_(
-                'Missing Partner Bank Account on payment line %s') % self.name)
+            problems.append(('missing_partner_bank', _(
+                'Missing Partner Bank Account on payment line %s')
+                % self.name))
+        return problems
+
+    @api.multi
+    def draft2open_payment_line_check(self):
+        self.ensure_one()
+        problems = self._get_draft2open_problems()
+        if problems:
+            raise UserError(problems[0][1])
@@ -82,6 +82,22 @@ class AccountPaymentMode(models.Model):
         ('line', 'One move per payment line'),
         ], string='Move Option', default='date')
     post_move = fields.Boolean(string='Post Move', default=True)
+    async_transitions = fields.Boolean(
+        string='Process in Background',
+        help="Confirm the payment orders, generate their payment file and "
+        "generate their transfer moves in a background job, which commits "
+        "its work by chunks. Recommended for payment orders of several "
+        "thousands of lines, which would otherwise exceed the time limit "
+        "of the web workers.")
+    record_metrics = fields.Selection([
+        ('time', 'Time and Queries'),
+        ('memory', 'Time, Queries and Memory'),
+        ], string='Record Metrics',
+        help="Record the duration, the number of SQL queries and the "
+        "number of rows written by each stage of the payment orders of "
+        "this mode, in the menu Payments > Payment Order Metrics. "
+        "Measuring the memory slows down the whole server process, so "
+        "it should only be enabled while investigating an issue.")
 
     @api.multi
     @api.constrains(
@@ -5,9 +5,16 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 
 import base64
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError, ValidationError
 
+# Number of problems listed in the error raised on confirmation
+PREFLIGHT_MAX_MESSAGES = 50
+
 
 class AccountPaymentOrder(models.Model):
     _name = 'account.payment.order'
@@ -105,6 +112,13 @@ class AccountPaymentOrder(models.Model):
         'account.move', 'payment_order_id', string='Journal Entries',
         readonly=True)
     description = fields.Char()
+    job_ids = fields.One2many(
+        'account.payment.order.job', 'order_id', string='Background Jobs',
+        readonly=True)
+    processing = fields.Boolean(
+        compute='_compute_processing', string='Processing in Background')
+    processing_progress = fields.Float(
+        compute='_compute_processing', string='Progress')
 
     @api.multi
     def unlink(self):
@@ -210,9 +224,21 @@ class AccountPaymentOrder(models.Model):
 
     @api.multi
     def action_cancel(self):
+        """The bank payment lines of an order whose payment file was not
+        generated are kept, so that confirming the order again after
+        'Back to Draft' only updates the groups of payment lines that
+        changed, cf _plan_bank_lines(). Once the file is generated, the
+        references of the bank payment lines were sent to the bank, so
+        they are removed and new ones are created on confirmation"""
         for order in self:
-            order.write({'state': 'cancel'})
-            order.bank_line_ids.unlink()
+            if order.processing:
+                raise UserError(_(
+                    "You cannot cancel the payment order %s while it is "
+                    "processed in the background.") % order.name)
+        generated_orders = self.filtered(
+            lambda x: x.state in ('generated', 'uploaded'))
+        self.write({'state': 'cancel'})
+        generated_orders.mapped('bank_line_ids').unlink()
         return True
 
     @api.model
@@ -224,6 +250,414 @@ class AccountPaymentOrder(models.Model):
                 [line.communication for line in paylines]),
             }
 
+    @api.multi
+    def _get_draft2open_order_problems(self):
+        """Return the problems of the order that block its confirmation,
+        as a list of (code, message). Designed to be inherited"""
+        self.ensure_one()
+        problems = []
+        if not self.journal_id:
+            problems.append(('missing_journal', _(
+                'Missing Bank Journal on payment order %s.') % self.name))
+        elif (
+                self.payment_method_id.bank_account_required and
+                not self.journal_id.bank_account_id):
+            problems.append(('missing_journal_bank_account', _(
+                "Missing bank account on bank journal '%s'.")
+                % self.journal_id.display_name))
+        if not self.payment_line_ids:
+            problems.append(('no_payment_line', _(
+                'There are no transactions on payment order %s.')
+                % self.name))
+        return problems
+
+    @api.multi
+    def _draft2open_order_check(self):
+        self.ensure_one()
+        problems = self._get_draft2open_order_problems()
+        if problems:
+            raise UserError(problems[0][1])
+
+    @api.multi
+    def _get_payment_line_requested_date(self, payline, today):
+        """Compute the requested payment date of a payment line depending
+        on the 'date_prefered' setting of the payment order"""
+        self.ensure_one()
+        if self.date_prefered == 'due':
+            requested_date = payline.ml_maturity_date or today
+        elif self.date_prefered == 'fixed':
+            requested_date = self.date_scheduled or today
+        else:
+            requested_date = today
+        # No payment date in the past
+        if requested_date < today:
+            requested_date = today
+        # inbound: check option no_debit_before_maturity
+        if (
+                self.payment_type == 'inbound' and
+                self.payment_mode_id.no_debit_before_maturity and
+                payline.ml_maturity_date and
+                requested_date < payline.ml_maturity_date):
+            raise UserError(_(
+                "The payment mode '%s' has the option "
+                "'Disallow Debit Before Maturity Date'. The "
+                "payment line %s has a maturity date %s "
+                "which is after the computed payment date %s.") % (
+                    self.payment_mode_id.name,
+                    payline.name,
+                    payline.ml_maturity_date,
+                    requested_date))
+        return requested_date
+
+    @api.multi
+    def _write_payment_lines_date(self, requested_dates):
+        """Write the requested payment dates computed by
+        _get_preflight_problems(), with one write per distinct date"""
+        self.ensure_one()
+        payline_ids_per_date = OrderedDict()
+        for payline in self.payment_line_ids:
+            requested_date = requested_dates[payline.id]
+            if payline.date != requested_date:
+                payline_ids_per_date.setdefault(
+                    requested_date, []).append(payline.id)
+        for requested_date, payline_ids in payline_ids_per_date.items():
+            self.payment_line_ids.browse(payline_ids).write(
+                {'date': requested_date})
+
+    @api.multi
+    def _group_payment_lines(self, requested_dates=None):
+        """Group the payment lines of the order by hashcode
+        requested_dates is an optional dict payment line ID -> requested
+        payment date, to group the payment lines with dates that are not
+        written yet, cf get_preflight_problems()
+        Returns a dict: key = hashcode,
+        value = {'paylines': recordset, 'total': amount}"""
+        self.ensure_one()
+        group_lines = self.payment_mode_id.group_lines
+        groups = OrderedDict()
+        for payline in self.payment_line_ids:
+            if group_lines and requested_dates:
+                hashcode = payline.with_context(
+                    payment_line_requested_date=requested_dates[payline.id]
+                ).payment_line_hashcode()
+            elif group_lines:
+                hashcode = payline.payment_line_hashcode()
+            else:
+                # Use line ID as hascode, which actually means no grouping
+                hashcode = payline.id
+            group = groups.setdefault(
+                hashcode, {'payline_ids': [], 'total': 0.0})
+            group['payline_ids'].append(payline.id)
+            group['total'] += payline.amount_currency
+        group_paylines = OrderedDict()
+        for hashcode, group in groups.items():
+            group_paylines[hashcode] = {
+                'paylines': self.payment_line_ids.browse(group['payline_ids']),
+                'total': group['total'],
+            }
+        return group_paylines
+
+    @api.multi
+    def _get_group_total_problems(self, group_paylines):
+        """Return the groups of payment lines with a negative or null
+        total, as a list of (code, message, paylines)"""
+        problems = []
+        for paydict in group_paylines.values():
+            # Block if a bank payment line is <= 0
+            if paydict['total'] <= 0:
+                problems.append(('negative_total', _(
+                    "The amount for Partner '%s' is negative "
+                    "or null (%.2f) !")
+                    % (paydict['paylines'][0].partner_id.name,
+                       paydict['total']), paydict['paylines']))
+        return problems
+
+    @api.multi
+    def _prepare_preflight_problem(
+            self, code, message, paylines=None, blocking=True):
+        self.ensure_one()
+        return {
+            'order_id': self.id,
+            'payment_line_ids': paylines and paylines.ids or [],
+            'partner_id': paylines and paylines[0].partner_id.id or False,
+            'code': code,
+            'message': message,
+            'blocking': blocking,
+            }
+
+    @api.multi
+    def _get_preflight_problems(self, preflight_data=None):
+        """Return all the problems of the order for its confirmation or
+        the generation of its payment file, cf get_preflight_problems().
+        Designed to be inherited
+        When preflight_data is a dict, it is filled with the requested
+        payment dates computed by the checks ('requested_dates': dict
+        payment line ID -> date) and the groups of payment lines
+        ('group_paylines', cf _group_payment_lines()), so that they are
+        not computed again by draft2open()"""
+        self.ensure_one()
+        problems = [
+            self._prepare_preflight_problem(code, message)
+            for code, message in self._get_draft2open_order_problems()]
+        paylines = self.payment_line_ids
+        # Read the partners and bank accounts of all the lines at once
+        paylines.mapped('partner_id')
+        paylines.mapped('partner_bank_id')
+        today = fields.Date.context_today(self)
+        requested_dates = {}
+        for payline in paylines:
+            for code, message in payline._get_draft2open_problems():
+                problems.append(self._prepare_preflight_problem(
+                    code, message, payline))
+            try:
+                requested_dates[payline.id] = \
+                    self._get_payment_line_requested_date(payline, today)
+            except UserError as e:
+                problems.append(self._prepare_preflight_problem(
+                    'requested_date', e.name, payline))
+                requested_dates[payline.id] = payline.date
+        group_paylines = self._group_payment_lines(requested_dates)
+        for code, message, group in self._get_group_total_problems(
+                group_paylines):
+            problems.append(self._prepare_preflight_problem(
+                code, message, group))
+        if preflight_data is not None:
+            preflight_data.update({
+                'requested_dates': requested_dates,
+                'group_paylines': group_paylines,
+                })
+        return problems
+
+    @api.multi
+    def get_preflight_problems(self):
+        """Check the payment orders without writing anything and return
+        all the problems of their confirmation or of the generation of
+        their payment file, instead of stopping at the first one.
+        Returns a list of dicts with the keys 'order_id',
+        'payment_line_ids', 'partner_id', 'code', 'message' and
+        'blocking': False for the warnings, which do not block the
+        confirmation"""
+        problems = []
+        for order in self:
+            problems += order._get_preflight_problems()
+        return problems
+
+    @api.multi
+    def _check_preflight_problems(self, preflight_data=None):
+        """Raise one error with all the blocking problems of the order and
+        post the warnings on the order
+        preflight_data: cf _get_preflight_problems()"""
+        self.ensure_one()
+        problems = self._get_preflight_problems(preflight_data=preflight_data)
+        warnings = [
+            problem['message'] for problem in problems
+            if not problem['blocking']]
+        problems = [problem for problem in problems if problem['blocking']]
+        if problems:
+            messages = [problem['message'] for problem in problems]
+            if len(messages) > PREFLIGHT_MAX_MESSAGES:
+                messages = messages[:PREFLIGHT_MAX_MESSAGES] + [_(
+                    "... and %d other problems.") % (
+                        len(messages) - PREFLIGHT_MAX_MESSAGES)]
+            raise UserError('\n'.join(messages))
+        if warnings:
+            self.message_post(body='<br/>'.join(
+                [_('Warnings on confirmation:')] + warnings))
+
+    @api.multi
+    def _plan_bank_lines(self, group_paylines):
+        """Compare the groups of payment lines with the existing bank
+        payment lines of the order. A bank payment line is kept when it
+        has exactly the payment lines of a group, so re-confirming an
+        order only touches the groups that changed.
+        Returns a dict with the keys:
+        'update': list of (bank line, values that changed),
+        'create': list of the values of the new bank lines,
+        'unlink': bank lines that no longer match a group"""
+        self.ensure_one()
+        bank_lines = self.bank_line_ids
+        bline_per_paylines = {}
+        for bline in bank_lines:
+            bline_per_paylines[frozenset(bline.payment_line_ids.ids)] = bline
+        plan = {'update': [], 'create': []}
+        for paydict in group_paylines.values():
+            paylines = paydict['paylines']
+            vals = self._prepare_bank_payment_line(paylines)
+            bline = bline_per_paylines.pop(frozenset(paylines.ids), None)
+            if bline is None:
+                plan['create'].append(vals)
+                continue
+            changed_vals = {}
+            for fname, value in vals.items():
+                if fname in ('order_id', 'payment_line_ids'):
+                    continue
+                field = bline._fields[fname]
+                if field.convert_to_write(bline[fname], bline) != value:
+                    changed_vals[fname] = value
+            if changed_vals:
+                plan['update'].append((bline, changed_vals))
+        plan['unlink'] = bank_lines.browse(
+            [bline.id for bline in bline_per_paylines.values()])
+        return plan
+
+    @api.multi
+    def _apply_bank_lines_plan(self, plan):
+        """Apply the plan returned by _plan_bank_lines().
+        Returns the new bank payment lines"""
+        self.ensure_one()
+        plan['unlink'].unlink()
+        for bline, vals in plan['update']:
+            bline.write(vals)
+        return self.env['bank.payment.line']._create_batch(plan['create'])
+
+    @api.multi
+    def _preview_payment_files(self, bank_lines):
+        """Return the list of the (payment file as string, filename) of the
+        order for the bank payment lines in memory of get_preview(),
+        without writing anything. Designed to be inherited by the modules
+        generating payment files"""
+        self.ensure_one()
+        return []
+
+    @api.multi
+    def get_preview(self):
+        """Simulate the confirmation of the order and the generation of its
+        payment file, without writing anything in the database: the
+        requested payment dates are only set in the cache of the payment
+        lines and the bank payment lines are records in memory.
+        Returns a dict with the keys:
+        'problems': list of the problems, cf get_preflight_problems(),
+        'groups': list of dicts, one per bank payment line,
+        'total_company_currency': total of the bank payment lines,
+        'files': list of the (payment file as string, filename)"""
+        self.ensure_one()
+        preflight_data = {}
+        preview = {
+            'problems': self._get_preflight_problems(
+                preflight_data=preflight_data),
+            'groups': [],
+            'total_company_currency': 0.0,
+            'files': [],
+            }
+        if any(problem['blocking'] for problem in preview['problems']):
+            return preview
+        paylines = self.payment_line_ids
+        bplo = self.env['bank.payment.line']
+        bank_line_ids = []
+        requested_dates = preflight_data['requested_dates']
+        try:
+            for payline in paylines:
+                payline._cache['date'] = requested_dates[payline.id]
+            group_paylines = preflight_data['group_paylines']
+            for index, paydict in enumerate(group_paylines.values(), 1):
+                vals = self._prepare_bank_payment_line(paydict['paylines'])
+                vals['name'] = '%s-%d' % (self.name, index)
+                bank_line_ids.append(bplo.new(vals).id)
+            for bline in bplo.browse(bank_line_ids):
+                preview['groups'].append({
+                    'payment_line_ids': bline.payment_line_ids.ids,
+                    'partner_id': bline.partner_id.id,
+                    'partner_bank_id': bline.partner_bank_id.id,
+                    'currency_id': bline.currency_id.id,
+                    'date': bline.date,
+                    'communication': bline.communication,
+                    'amount_currency': bline.amount_currency,
+                    'amount_company_currency': bline.amount_company_currency,
+                    })
+                preview['total_company_currency'] += \
+                    bline.amount_company_currency
+            try:
+                preview['files'] = self._preview_payment_files(
+                    bplo.browse(bank_line_ids))
+            except UserError as e:
+                preview['problems'].append(self._prepare_preflight_problem(
+                    'payment_file', e.name))
+        finally:
+            # Forget the requested dates and the bank payment lines
+            paylines.invalidate_cache(['date'], paylines.ids)
+            bplo.invalidate_cache(ids=bank_line_ids)
+        return preview
+
+    @api.multi
+    @api.depends('job_ids.state', 'job_ids.progress')
+    def _compute_processing(self):
+        for order in self:
+            jobs = order.job_ids.filtered(
+                lambda x: x.state in ('pending', 'running'))
+            order.processing = bool(jobs)
+            order.processing_progress = jobs and jobs[0].progress or 0.0
+
+    @api.multi
+    def _queue_transition_jobs(self, transition):
+        """Queue a background job running the transition for the orders
+        whose payment mode processes the payment orders in background.
+        Returns these orders"""
+        if self._context.get('payment_order_job'):
+            return self.browse()
+        orders = self.filtered(lambda x: x.payment_mode_id.async_transitions)
+        for order in orders:
+            if order.processing:
+                raise UserError(_(
+                    "The payment order %s is already being processed in "
+                    "the background.") % order.name)
+            self.env['account.payment.order.job'].create({
+                'order_id': order.id,
+                'transition': transition,
+                })
+        return orders
+
+    @contextmanager
+    def _instrument_stage(self, stage):
+        """Record the duration, the number of SQL queries, the number of
+        rows written and optionally the memory peak of a stage of the
+        payment order, if it is enabled on the payment mode or with
+        payment_order_metrics = 'time' or 'memory' in the context.
+        The memory is only measured by the outermost stage.
+        Nothing is recorded for a stage that fails: its transaction is
+        rolled back, with the metric that would be created in it"""
+        metrics = (
+            self._context.get('payment_order_metrics') or
+            self.payment_mode_id.record_metrics)
+        if not metrics:
+            yield
+            return
+        self.ensure_one()
+        cr = self.env.cr
+        trace_memory = metrics == 'memory' and not tracemalloc.is_tracing()
+        if trace_memory:
+            tracemalloc.start()
+        cr.execute(
+            "SELECT COALESCE(SUM(n_tup_ins + n_tup_upd + n_tup_del), 0) "
+            "FROM pg_stat_xact_user_tables")
+        rows_before = cr.fetchone()[0]
+        queries_before = cr.sql_log_count
+        start = time.time()
+        memory_peak = 0.0
+        try:
+            yield
+            if trace_memory:
+                memory_peak = tracemalloc.get_traced_memory()[1] / 1024.0
+        finally:
+            # Tracing the memory slows down all the allocations of the
+            # process, so it must be stopped even if the stage fails
+            if trace_memory:
+                tracemalloc.stop()
+        duration = time.time() - start
+        query_count = cr.sql_log_count - queries_before
+        cr.execute(
+            "SELECT COALESCE(SUM(n_tup_ins + n_tup_upd + n_tup_del), 0) "
+            "FROM pg_stat_xact_user_tables")
+        rows_written = cr.fetchone()[0] - rows_before
+        self.env['account.payment.order.metric'].sudo().create({
+            'order_id': self.id,
+            'stage': stage,
+            'line_count': len(self.payment_line_ids),
+            'duration': duration,
+            'query_count': query_count,
+            'rows_written': rows_written,
+            'memory_peak': memory_peak,
+            })
+
     @api.multi
     def draft2open(self):
         """
@@ -232,83 +666,57 @@ class AccountPaymentOrder(models.Model):
         setting of the payment.order
         Re-generate the bank payment lines
         """
+        orders = self - self._queue_transition_jobs('draft2open')
+        for order in orders:
+            with order._instrument_stage('draft2open'):
+                # The checks compute the requested payment dates and the
+                # groups of payment lines, which are reused here
+                preflight_data = {}
+                order._check_preflight_problems(preflight_data)
+                order._write_payment_lines_date(
+                    preflight_data['requested_dates'])
+                # Update the bank payment lines from the payment lines
+                plan = order._plan_bank_lines(
+                    preflight_data['group_paylines'])
+                order._apply_bank_lines_plan(plan)
+        orders.write({'state': 'open'})
+        return True
+
+    @api.multi
+    def _draft2open_job_steps(self, chunk_size):
+        """Same as draft2open() for a background job: the bank payment
+        lines are created by chunks and the progress is yielded after each
+        chunk. The bank payment lines of the chunks committed before an
+        interruption of the worker are kept by _plan_bank_lines(), so a
+        resumed job only creates the missing ones. If a chunk fails, they
+        are removed, cf _draft2open_job_failed()"""
+        self.ensure_one()
+        if self.state != 'draft':
+            # The transition was completed before an interruption
+            return
+        preflight_data = {}
+        self._check_preflight_problems(preflight_data)
+        self._write_payment_lines_date(preflight_data['requested_dates'])
+        plan = self._plan_bank_lines(preflight_data['group_paylines'])
+        create_vals = plan['create']
+        plan['create'] = []
+        self._apply_bank_lines_plan(plan)
         bplo = self.env['bank.payment.line']
-        today = fields.Date.context_today(self)
-        for order in self:
-            if not order.journal_id:
-                raise UserError(_(
-                    'Missing Bank Journal on payment order %s.') % order.name)
-            if (
-                    order.payment_method_id.bank_account_required and
-                    not order.journal_id.bank_account_id):
-                raise UserError(_(
-                    "Missing bank account on bank journal '%s'.")
-                    % order.journal_id.display_name)
-            if not order.payment_line_ids:
-                raise UserError(_(
-                    'There are no transactions on payment order %s.')
-                    % order.name)
-            # Delete existing bank payment lines
-            order.bank_line_ids.unlink()
-            # Create the bank payment lines from the payment lines
-            group_paylines = {}  # key = hashcode
-            for payline in order.payment_line_ids:
-                payline.draft2open_payment_line_check()
-                # Compute requested payment date
-                if order.date_prefered == 'due':
-                    requested_date = payline.ml_maturity_date or today
-                elif order.date_prefered == 'fixed':
-                    requested_date = order.date_scheduled or today
-                else:
-                    requested_date = today
-                # No payment date in the past
-                if requested_date < today:
-                    requested_date = today
-                # inbound: check option no_debit_before_maturity
-                if (
-                        order.payment_type == 'inbound' and
-                        order.payment_mode_id.no_debit_before_maturity and
-                        payline.ml_maturity_date and
-                        requested_date < payline.ml_maturity_date):
-                    raise UserError(_(
-                        "The payment mode '%s' has the option "
-                        "'Disallow Debit Before Maturity Date'. The "
-                        "payment line %s has a maturity date %s "
-                        "which is after the computed payment date %s.") % (
-                            order.payment_mode_id.name,
-                            payline.name,
-                            payline.ml_maturity_date,
-                            requested_date))
-                # Write requested_date on 'date' field of payment line
-                payline.date = requested_date
-                # Group options
-                if order.payment_mode_id.group_lines:
-                    hashcode = payline.payment_line_hashcode()
-                else:
-                    # Use line ID as hascode, which actually means no grouping
-                    hashcode = payline.id
-                if hashcode in group_paylines:
-                    group_paylines[hashcode]['paylines'] += payline
-                    group_paylines[hashcode]['total'] +=\
-                        payline.amount_currency
-                else:
-                    group_paylines[hashcode] = {
-                        'paylines': payline,
-                        'total': payline.amount_currency,
-                    }
-            # Create bank payment lines
-            for paydict in list(group_paylines.values()):
-                # Block if a bank payment line is <= 0
-                if paydict['total'] <= 0:
-                    raise UserError(_(
-                        "The amount for Partner '%s' is negative "
-                        "or null (%.2f) !")
-                        % (paydict['paylines'][0].partner_id.name,
-                           paydict['total']))
-                vals = self._prepare_bank_payment_line(paydict['paylines'])
-                bplo.create(vals)
+        for start in range(0, len(create_vals), chunk_size):
+            bplo._create_batch(create_vals[start:start + chunk_size])
+            yield min(99.0, 100.0 * (start + chunk_size) / len(create_vals))
         self.write({'state': 'open'})
-        return True
+        yield 100.0
+
+    @api.multi
+    def _draft2open_job_failed(self):
+        """Called when the background job of draft2open() fails: the bank
+        payment lines of the chunks committed before the failure are
+        removed, so that the draft order has no partial set of bank
+        payment lines. They are created again on the next confirmation"""
+        self.ensure_one()
+        if self.state == 'draft':
+            self.bank_line_ids.unlink()
 
     @api.multi
     def generate_payment_file(self):
@@ -321,19 +729,53 @@ class AccountPaymentOrder(models.Model):
                 "No handler for this payment method. Maybe you haven't "
                 "installed the related Odoo module."))
 
+    @api.multi
+    def _get_payment_files(self):
+        """Returns the list of the (payment file as string, filename) of
+        the order. There is one file, unless a module splits the payment
+        order in several files"""
+        self.ensure_one()
+        return [self.generate_payment_file()]
+
+    @api.multi
+    def _set_generated(self, payment_file_str, filename):
+        """Attach the payment file to the order and set the order as
+        generated. Return the attachment, if any"""
+        return self._set_generated_files([(payment_file_str, filename)])
+
+    @api.multi
+    def _set_generated_files(self, files):
+        """Attach the payment files returned by _get_payment_files() to the
+        order and set the order as generated. Return the attachments"""
+        self.ensure_one()
+        attachments = self.env['ir.attachment']
+        for payment_file_str, filename in files:
+            if payment_file_str and filename:
+                attachments |= attachments.create({
+                    'res_model': 'account.payment.order',
+                    'res_id': self.id,
+                    'name': filename,
+                    'datas': base64.b64encode(payment_file_str),
+                    'datas_fname': filename,
+                    })
+        self.write({
+            'date_generated': fields.Date.context_today(self),
+            'state': 'generated',
+            'generated_user_id': self._uid,
+            })
+        return attachments
+
     @api.multi
     def open2generated(self):
         self.ensure_one()
-        payment_file_str, filename = self.generate_payment_file()
+        if self._queue_transition_jobs('open2generated'):
+            return True
+        with self._instrument_stage('open2generated'):
+            with self._instrument_stage('generate_payment_file'):
+                files = self._get_payment_files()
+            attachments = self._set_generated_files(files)
         action = {}
-        if payment_file_str and filename:
-            attachment = self.env['ir.attachment'].create({
-                'res_model': 'account.payment.order',
-                'res_id': self.id,
-                'name': filename,
-                'datas': base64.b64encode(payment_file_str),
-                'datas_fname': filename,
-                })
+        if len(attachments) == 1:
             simplified_form_view = self.env.ref(
                 'account_payment_order.view_attachment_simplified_form')
             action = {
@@ -343,26 +785,121 @@ class AccountPaymentOrder(models.Model):
                 'res_model': 'ir.attachment',
                 'type': 'ir.actions.act_window',
                 'target': 'current',
-                'res_id': attachment.id,
+                'res_id': attachments.id,
+                }
+        elif attachments:
+            action = {
+                'name': _('Payment Files'),
+                'view_mode': 'tree,form',
+                'res_model': 'ir.attachment',
+                'type': 'ir.actions.act_window',
+                'domain': [('id', 'in', attachments.ids)],
                 }
-        self.write({
-            'date_generated': fields.Date.context_today(self),
-            'state': 'generated',
-            'generated_user_id': self._uid,
-            })
         return action
 
     @api.multi
-    def generated2uploaded(self):
+    def _open2generated_job_steps(self, chunk_size):
+        """Same as open2generated() for a background job. The payment
+        file is generated at once, so there is only one step"""
+        self.ensure_one()
+        if self.state != 'open':
+            # The transition was completed before an interruption
+            return
+        self.open2generated()
+        yield 100.0
+
+    @api.multi
+    def _generate_payment_files(self):
+        """Generate the payment files of several orders. Each order is
+        generated in its own savepoint, so that an order which can't be
+        generated doesn't abort the generation of the others.
+        Returns ({order ID: list of (payment file as string, filename)},
+        {order ID: error message})"""
+        files = {}
+        errors = {}
         for order in self:
-            if order.payment_mode_id.generate_move:
-                order.generate_move()
-        self.write({
+            try:
+                with self.env.cr.savepoint(), \
+                        order._instrument_stage('generate_payment_file'):
+                    files[order.id] = order._get_payment_files()
+            except (UserError, ValidationError) as e:
+                self.env.invalidate_all()
+                errors[order.id] = e.name
+        return files, errors
+
+    @api.multi
+    def open2generated_batch(self):
+        """Generate the payment files of several confirmed orders. The
+        orders which can't be generated stay confirmed and the error is
+        posted on them. As for open2generated(), the orders whose payment
+        mode processes the payment orders in background are queued"""
+        orders = self.filtered(lambda x: x.state == 'open')
+        orders -= orders._queue_transition_jobs('open2generated')
+        files, errors = orders._generate_payment_files()
+        attachments = self.env['ir.attachment']
+        for order in orders:
+            if order.id in errors:
+                order.message_post(body=_(
+                    "The payment file could not be generated: %s")
+                    % errors[order.id])
+            else:
+                attachments |= order._set_generated_files(files[order.id])
+        if not attachments:
+            return False
+        return {
+            'name': _('Payment Files'),
+            'view_mode': 'tree,form',
+            'res_model': 'ir.attachment',
+            'type': 'ir.actions.act_window',
+            'domain': [('id', 'in', attachments.ids)],
+            }
+
+    @api.multi
+    def generated2uploaded(self):
+        orders = self - self._queue_transition_jobs('generated2uploaded')
+        for order in orders:
+            with order._instrument_stage('generated2uploaded'):
+                if order.payment_mode_id.generate_move:
+                    order.generate_move()
+        orders.write({
             'state': 'uploaded',
             'date_uploaded': fields.Date.context_today(self),
             })
         return True
 
+    @api.multi
+    def _generated2uploaded_job_steps(self, chunk_size):
+        """Same as generated2uploaded() for a background job: the
+        transfer moves are generated by chunks of about chunk_size bank
+        payment lines and the progress is yielded after each chunk.
+        A resumed job skips the bank payment lines that already have
+        their transfer move"""
+        self.ensure_one()
+        if self.state != 'generated':
+            # The transition was completed before an interruption
+            return
+        if self.payment_mode_id.generate_move:
+            bank_lines = self.bank_line_ids.filtered(
+                lambda x: not x.transit_move_line_ids)
+            groups = self._get_transfer_move_groups(bank_lines)
+            chunk = []
+            chunk_line_count = 0
+            for index, blines in enumerate(groups):
+                chunk.append(blines)
+                chunk_line_count += len(blines)
+                if chunk_line_count >= chunk_size:
+                    self._generate_transfer_moves(chunk)
+                    chunk = []
+                    chunk_line_count = 0
+                    yield min(99.0, 100.0 * (index + 1) / len(groups))
+            if chunk:
+                self._generate_transfer_moves(chunk)
+        self.write({
+            'state': 'uploaded',
+            'date_uploaded': fields.Date.context_today(self),
+            })
+        yield 100.0
+
     @api.multi
     def _prepare_move(self, bank_lines=None):
         if self.payment_type == 'outbound':
@@ -459,28 +996,50 @@ class AccountPaymentOrder(models.Model):
                 })
         return vals
 
+    @api.model
+    def _create_transfer_moves(self, moves_vals):
+        """Create the transfer moves of the payment order at once: the
+        stored computed fields of the moves and of their lines are
+        recomputed once for all the moves"""
+        am_obj = self.env['account.move']
+        move_ids = []
+        with self.env.norecompute():
+            for mvals in moves_vals:
+                move_ids.append(am_obj.create(mvals).id)
+        am_obj.recompute()
+        return am_obj.browse(move_ids)
+
     @api.multi
-    def generate_move(self):
-        """
-        Create the moves that pay off the move lines from
-        the payment/debit order.
-        """
+    def _get_transfer_move_groups(self, bank_lines):
+        """Group the bank payment lines by transfer move, cf
+        move_line_offsetting_account_hashcode().
+        Returns a list of recordsets of bank payment lines"""
         self.ensure_one()
-        am_obj = self.env['account.move']
-        post_move = self.payment_mode_id.post_move
         # prepare a dict "trfmoves" that can be used when
         # self.payment_mode_id.move_option = date or line
         # key = unique identifier (date or True or line.id)
-        # value = bank_pay_lines (recordset that can have several entries)
-        trfmoves = {}
-        for bline in self.bank_line_ids:
+        # value = ids of the bank payment lines (several entries possible)
+        trfmoves = OrderedDict()
+        for bline in bank_lines:
             hashcode = bline.move_line_offsetting_account_hashcode()
             if hashcode in trfmoves:
-                trfmoves[hashcode] += bline
+                trfmoves[hashcode].append(bline.id)
             else:
-                trfmoves[hashcode] = bline
+                trfmoves[hashcode] = [bline.id]
+        return [
+            bank_lines.browse(bline_ids).with_prefetch(bank_lines._prefetch)
+            for bline_ids in trfmoves.values()]
 
-        for hashcode, blines in trfmoves.items():
+    @api.multi
+    def _generate_transfer_moves(self, groups):
+        """Create, reconcile and post the transfer moves of the groups of
+        bank payment lines returned by _get_transfer_move_groups()"""
+        self.ensure_one()
+        bank_lines = self.env['bank.payment.line'].concat(*groups)
+        # Read the move lines to pay of all the bank lines at once
+        bank_lines.mapped('payment_line_ids.move_line_id')
+        moves_vals = []
+        for blines in groups:
             mvals = self._prepare_move(blines)
             total_company_currency = total_payment_currency = 0
             for bline in blines:
@@ -492,7 +1051,21 @@ class AccountPaymentOrder(models.Model):
             trf_ml_vals = self._prepare_move_line_offsetting_account(
                 total_company_currency, total_payment_currency, blines)
             mvals['line_ids'].append((0, 0, trf_ml_vals))
-            move = am_obj.create(mvals)
-            blines.reconcile_payment_lines()
-            if post_move:
-                move.post()
+            moves_vals.append(mvals)
+        moves = self._create_transfer_moves(moves_vals)
+        with self._instrument_stage('reconcile_payment_lines'):
+            bank_lines.reconcile_payment_lines()
+        if self.payment_mode_id.post_move:
+            moves.post()
+        return moves
+
+    @api.multi
+    def generate_move(self):
+        """
+        Create the moves that pay off the move lines from
+        the payment/debit order.
+        """
+        self.ensure_one()
+        with self._instrument_stage('generate_move'):
+            self._generate_transfer_moves(
+                self._get_transfer_move_groups(self.bank_line_ids))
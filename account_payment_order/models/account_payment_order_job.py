@@ -0,0 +1,129 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+import logging
+import threading
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+
+logger = logging.getLogger(__name__)
+
+# Number of bank payment lines processed between two commits
+JOB_CHUNK_SIZE = 500
+# First key of the PostgreSQL advisory locks held by the running jobs
+JOB_LOCK_KEY = 1346459978
+
+
+class AccountPaymentOrderJob(models.Model):
+    """Background job running a transition of a payment order, when the
+    option 'Process in Background' is set on the payment mode, cf
+    AccountPaymentOrder._queue_transition_jobs()"""
+    _name = 'account.payment.order.job'
+    _description = 'Payment Order Background Job'
+    _order = 'id'
+    _rec_name = 'transition'
+
+    order_id = fields.Many2one(
+        'account.payment.order', string='Payment Order', required=True,
+        ondelete='cascade', index=True, readonly=True)
+    company_id = fields.Many2one(
+        'res.company', related='order_id.company_id', string='Company',
+        store=True, readonly=True)
+    transition = fields.Selection([
+        ('draft2open', 'Confirm Payments'),
+        ('open2generated', 'Generate Payment File'),
+        ('generated2uploaded', 'File Successfully Uploaded'),
+        ], string='Transition', required=True, readonly=True)
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+        ], string='State', required=True, readonly=True, default='pending',
+        index=True)
+    progress = fields.Float(string='Progress', readonly=True)
+    user_id = fields.Many2one(
+        'res.users', string='User', required=True, readonly=True,
+        default=lambda self: self.env.user)
+    date_start = fields.Datetime(string='Start Date', readonly=True)
+    date_done = fields.Datetime(string='End Date', readonly=True)
+    error = fields.Text(string='Error', readonly=True)
+
+    @api.model
+    def _commit(self):
+        # The tests run in a single transaction, which must not be committed
+        if not getattr(threading.currentThread(), 'testing', False):
+            self.env.cr.commit()  # pylint: disable=invalid-commit
+
+    @api.multi
+    def _run(self):
+        """Run the transition of the payment order as the user who launched
+        it, committing after each step of the _<transition>_job_steps()
+        method of the payment order"""
+        self.ensure_one()
+        order = self.order_id.sudo(self.user_id).with_context(
+            payment_order_job=self.id)
+        self.write({
+            'state': 'running',
+            'date_start': fields.Datetime.now(),
+            'error': False,
+            })
+        self._commit()
+        steps = getattr(order, '_%s_job_steps' % self.transition)(
+            JOB_CHUNK_SIZE)
+        try:
+            while True:
+                with self.env.cr.savepoint():
+                    progress = next(steps, None)
+                if progress is None:
+                    break
+                self.progress = progress
+                self._commit()
+        except Exception as e:
+            self.env.invalidate_all()
+            # Undo the steps committed before the failure, cf the
+            # _<transition>_job_failed() methods of the payment order
+            job_failed = getattr(
+                order, '_%s_job_failed' % self.transition, None)
+            if job_failed:
+                job_failed()
+            error = isinstance(e, UserError) and e.name or str(e)
+            logger.exception(
+                'Background job %s of payment order %s failed',
+                self.transition, self.order_id.name)
+            self.write({'state': 'failed', 'error': error})
+            order.message_post(body=_(
+                "The background job '%s' failed: %s") % (
+                    dict(self._fields['transition'].selection)[
+                        self.transition], error))
+        else:
+            self.write({
+                'state': 'done',
+                'progress': 100.0,
+                'date_done': fields.Datetime.now(),
+                })
+        self._commit()
+
+    @api.model
+    def _cron_run_jobs(self):
+        """Run the pending jobs, and resume the running jobs whose worker
+        was interrupted. A running job holds a session advisory lock,
+        which PostgreSQL releases when the worker dies"""
+        cr = self.env.cr
+        for job in self.search([('state', 'in', ('pending', 'running'))]):
+            cr.execute(
+                "SELECT pg_try_advisory_lock(%s, %s)", (JOB_LOCK_KEY, job.id))
+            if not cr.fetchone()[0]:
+                continue
+            try:
+                # Start a new transaction to read the current state of the
+                # job, it may have been run by another worker meanwhile
+                self._commit()
+                job.invalidate_cache(['state'], job.ids)
+                if job.state in ('pending', 'running'):
+                    job._run()
+            finally:
+                cr.execute(
+                    "SELECT pg_advisory_unlock(%s, %s)",
+                    (JOB_LOCK_KEY, job.id))
+        return True
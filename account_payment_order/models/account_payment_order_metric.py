@@ -0,0 +1,47 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+from odoo import models, fields
+
+
+class AccountPaymentOrderMetric(models.Model):
+    """Measure of a stage of a payment order, recorded when the option
+    'Record Metrics' is set on the payment mode, cf
+    AccountPaymentOrder._instrument_stage()"""
+    _name = 'account.payment.order.metric'
+    _description = 'Payment Order Metric'
+    _order = 'id desc'
+    _rec_name = 'stage'
+
+    order_id = fields.Many2one(
+        'account.payment.order', string='Payment Order', required=True,
+        ondelete='cascade', index=True, readonly=True)
+    payment_mode_id = fields.Many2one(
+        'account.payment.mode', related='order_id.payment_mode_id',
+        string='Payment Mode', store=True, readonly=True)
+    company_id = fields.Many2one(
+        'res.company', related='order_id.company_id', string='Company',
+        store=True, readonly=True)
+    stage = fields.Selection([
+        ('draft2open', 'Confirm'),
+        ('open2generated', 'Generate Payment File'),
+        ('generate_payment_file', 'Payment File Creation'),
+        ('generated2uploaded', 'File Successfully Uploaded'),
+        ('generate_move', 'Transfer Moves'),
+        ('reconcile_payment_lines', 'Reconciliation'),
+        ], string='Stage', required=True, readonly=True, index=True)
+    date = fields.Datetime(
+        string='Date', default=fields.Datetime.now, readonly=True)
+    user_id = fields.Many2one(
+        'res.users', string='User', readonly=True,
+        default=lambda self: self.env.user)
+    line_count = fields.Integer(string='Payment Lines', readonly=True)
+    duration = fields.Float(
+        string='Duration (s)', digits=(16, 3), readonly=True)
+    query_count = fields.Integer(string='SQL Queries', readonly=True)
+    rows_written = fields.Integer(
+        string='Rows Written', readonly=True,
+        help="Number of rows inserted, updated or deleted in the database")
+    memory_peak = fields.Float(
+        string='Memory Peak (KiB)', digits=(16, 1), readonly=True,
+        help="Peak of the memory allocated by Python during the stage. "
+        "Only recorded when the memory is measured on the payment mode.")
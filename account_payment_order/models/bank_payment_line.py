@@ -58,6 +58,9 @@ class BankPaymentLine(models.Model):
         'res.currency',
         related='order_id.payment_mode_id.company_id.currency_id',
         readonly=True, store=True)
+    transit_move_line_ids = fields.One2many(
+        'account.move.line', 'bank_payment_line_id',
+        string='Transit Journal Items', readonly=True)
 
     @api.model
     def same_fields_payment_line_and_bank_payment_line(self):
@@ -73,14 +76,21 @@ class BankPaymentLine(models.Model):
         return same_fields
 
     @api.multi
-    @api.depends('payment_line_ids', 'payment_line_ids.amount_currency')
+    @api.depends(
+        'payment_line_ids', 'payment_line_ids.amount_currency',
+        'payment_line_ids.currency_id', 'payment_line_ids.date')
     def _compute_amount(self):
+        rates = self.env['res.currency']._get_payment_conversion_rates(
+            (bline.currency_id or bline.company_currency_id,
+             bline.company_currency_id, bline.date)
+            for bline in self)
         for bline in self:
+            currency = bline.currency_id or bline.company_currency_id
             amount_currency = sum(
                 bline.mapped('payment_line_ids.amount_currency'))
-            amount_company_currency = bline.currency_id.with_context(
-                date=bline.date).compute(
-                    amount_currency, bline.company_currency_id)
+            amount_company_currency = currency._payment_convert(
+                amount_currency, bline.company_currency_id,
+                rates[(currency, bline.company_currency_id, bline.date)])
             bline.amount_currency = amount_currency
             bline.amount_company_currency = amount_company_currency
 
@@ -92,6 +102,13 @@ class BankPaymentLine(models.Model):
                 'bank.payment.line') or 'New'
         return super(BankPaymentLine, self).create(vals)
 
+    @api.model
+    def _create_batch(self, vals_list):
+        """Create several bank payment lines at once, cf
+        IrSequence.create_batch_by_code()"""
+        return self.env['ir.sequence'].create_batch_by_code(
+            self, 'bank.payment.line', vals_list)
+
     @api.multi
     def move_line_offsetting_account_hashcode(self):
         """
@@ -107,6 +124,11 @@ class BankPaymentLine(models.Model):
 
     @api.multi
     def reconcile_payment_lines(self):
+        # Read the transit move lines and the move lines to pay of all
+        # the bank lines at once, instead of one search per bank line
+        self.invalidate_cache(['transit_move_line_ids'], self.ids)
+        self.mapped('transit_move_line_ids')
+        self.mapped('payment_line_ids.move_line_id')
         for bline in self:
             if all([pline.move_line_id for pline in bline.payment_line_ids]):
                 bline.reconcile()
@@ -121,8 +143,7 @@ class BankPaymentLine(models.Model):
     @api.multi
     def reconcile(self):
         self.ensure_one()
-        amlo = self.env['account.move.line']
-        transit_mlines = amlo.search([('bank_payment_line_id', '=', self.id)])
+        transit_mlines = self.transit_move_line_ids
         assert len(transit_mlines) == 1, 'We should have only 1 move'
         transit_mline = transit_mlines[0]
         assert not transit_mline.reconciled,\
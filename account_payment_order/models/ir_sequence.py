@@ -0,0 +1,66 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+from odoo import models, api
+
+
+class IrSequence(models.Model):
+    _inherit = 'ir.sequence'
+
+    @api.model
+    def next_by_code_batch(self, sequence_code, count):
+        """Return a list of `count` successive values of the sequence
+        identified by `sequence_code`, reserved in a single round trip.
+        Sequences with date ranges are not supported by the batch
+        reservation, so we fall back on next_by_code() for them."""
+        if count <= 0:
+            return []
+        self.check_access_rights('read')
+        force_company = self._context.get('force_company')
+        if not force_company:
+            force_company = self.env.user.company_id.id
+        seqs = self.search([
+            ('code', '=', sequence_code),
+            ('company_id', 'in', [force_company, False])],
+            order='company_id')
+        if not seqs:
+            return [False] * count
+        seq = seqs[0]
+        if seq.use_date_range:
+            return [seq._next() for i in range(count)]
+        if seq.implementation == 'standard':
+            self._cr.execute(
+                "SELECT nextval('ir_sequence_%03d') "
+                "FROM generate_series(1, %%s)" % seq.id, (count, ))
+            numbers = [row[0] for row in self._cr.fetchall()]
+        else:
+            self._cr.execute(
+                "SELECT number_next FROM ir_sequence "
+                "WHERE id = %s FOR UPDATE NOWAIT", (seq.id, ))
+            number_next = self._cr.fetchone()[0]
+            self._cr.execute(
+                "UPDATE ir_sequence SET number_next = number_next + %s "
+                "WHERE id = %s", (seq.number_increment * count, seq.id))
+            seq.invalidate_cache(['number_next'], [seq.id])
+            numbers = [
+                number_next + i * seq.number_increment
+                for i in range(count)]
+        return [seq.get_next_char(number) for number in numbers]
+
+    @api.model
+    def create_batch_by_code(self, model, sequence_code, vals_list):
+        """Create several records of `model` (an empty recordset) at once:
+        the references of the values whose 'name' is 'New' are reserved
+        with a single call to next_by_code_batch() and the stored computed
+        fields are recomputed once for all the new records.
+        Returns the new records"""
+        to_name = [
+            vals for vals in vals_list if vals.get('name', 'New') == 'New']
+        names = self.next_by_code_batch(sequence_code, len(to_name))
+        for vals, name in zip(to_name, names):
+            vals['name'] = name or 'New'
+        record_ids = []
+        with model.env.norecompute():
+            for vals in vals_list:
+                record_ids.append(model.create(vals).id)
+        model.recompute()
+        return model.browse(record_ids)
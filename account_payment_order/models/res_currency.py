@@ -0,0 +1,31 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+from odoo import models, api
+
+
+class ResCurrency(models.Model):
+    _inherit = 'res.currency'
+
+    @api.model
+    def _get_payment_conversion_rates(self, keys):
+        """Return a dict {(from currency, to currency, date): rate} with the
+        conversion rate of each distinct key, so the amounts of the lines of
+        a payment order only cost one rate lookup per currency and date"""
+        rates = {}
+        for key in set(keys):
+            from_currency, to_currency, date = key
+            if from_currency == to_currency:
+                rates[key] = 1.0
+            else:
+                rates[key] = self.with_context(
+                    date=date)._get_conversion_rate(
+                        from_currency, to_currency)
+        return rates
+
+    @api.multi
+    def _payment_convert(self, from_amount, to_currency, rate):
+        """Same as compute(), with a rate returned by
+        _get_payment_conversion_rates()"""
+        if self == to_currency:
+            return to_currency.round(from_amount)
+        return to_currency.round(from_amount * rate)
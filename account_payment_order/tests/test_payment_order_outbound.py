@@ -2,7 +2,11 @@
 # © 2017 Creu Blanca
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
+import tracemalloc
 from datetime import date, datetime, timedelta
+from unittest import mock
+from odoo.addons.account_payment_order.models import \
+    account_payment_order_job
 from odoo.exceptions import UserError, ValidationError
 from odoo.tests.common import TransactionCase
 
@@ -182,3 +186,320 @@ class TestPaymentOrderOutbound(TransactionCase):
         with self.assertRaises(ValidationError):
             outbound_order.date_scheduled = date.today() - timedelta(
                 days=1)
+
+    def test_grouped_bank_lines(self):
+        self.mode.write({
+            'group_lines': True,
+            'bank_account_link': 'fixed',
+            'fixed_journal_id': self.bank_journal.id,
+        })
+        self.invoice.action_invoice_open()
+        self.invoice_02.action_invoice_open()
+        (self.invoice + self.invoice_02).create_account_payment_line()
+        order = self.env['account.payment.order'].search([
+            ('payment_mode_id', '=', self.mode.id),
+            ('state', '=', 'draft')])
+        self.assertEqual(len(order.payment_line_ids), 2)
+        order.draft2open()
+        self.assertEqual(order.state, 'open')
+        self.assertEqual(order.bank_line_count, 1)
+        self.assertEqual(
+            order.bank_line_ids.payment_line_ids, order.payment_line_ids)
+        self.assertEqual(order.bank_line_ids.amount_currency, 200.0)
+        self.assertTrue(order.bank_line_ids.name)
+
+    def test_reconfirm_keeps_bank_lines(self):
+        self.mode.write({
+            'group_lines': False,
+            'bank_account_link': 'fixed',
+            'fixed_journal_id': self.bank_journal.id,
+        })
+        self.invoice.action_invoice_open()
+        self.invoice_02.action_invoice_open()
+        (self.invoice + self.invoice_02).create_account_payment_line()
+        order = self.env['account.payment.order'].search([
+            ('payment_mode_id', '=', self.mode.id),
+            ('state', '=', 'draft')])
+        order.draft2open()
+        self.assertEqual(order.bank_line_count, 2)
+        bank_lines = order.bank_line_ids
+        plan = order._plan_bank_lines(order._group_payment_lines())
+        self.assertEqual(plan['create'], [])
+        self.assertEqual(plan['update'], [])
+        self.assertFalse(plan['unlink'])
+        # Same flow as in the user interface: cancel, back to draft
+        order.action_cancel()
+        self.assertEqual(order.state, 'cancel')
+        self.assertEqual(order.bank_line_ids, bank_lines)
+        order.cancel2draft()
+        removed_payline = order.payment_line_ids[0]
+        removed_bank_line = removed_payline.bank_line_id
+        removed_payline.unlink()
+        order.draft2open()
+        self.assertEqual(order.bank_line_count, 1)
+        self.assertEqual(order.bank_line_ids, bank_lines - removed_bank_line)
+        self.assertFalse(removed_bank_line.exists())
+
+    def test_preflight_problems(self):
+        self.mode.write({
+            'group_lines': False,
+            'bank_account_link': 'fixed',
+            'fixed_journal_id': self.bank_journal.id,
+        })
+        self.mode.payment_method_id.bank_account_required = True
+        self.invoice.action_invoice_open()
+        self.invoice_02.action_invoice_open()
+        (self.invoice + self.invoice_02).create_account_payment_line()
+        order = self.env['account.payment.order'].search([
+            ('payment_mode_id', '=', self.mode.id),
+            ('state', '=', 'draft')])
+        paylines = order.payment_line_ids
+        paylines.write({'partner_bank_id': False})
+        paylines[0].amount_currency = -10.0
+        dates = paylines.mapped('date')
+        problems = order.get_preflight_problems()
+        bank_problems = [
+            problem for problem in problems
+            if problem['code'] == 'missing_partner_bank']
+        self.assertEqual(
+            sorted(p['payment_line_ids'][0] for p in bank_problems),
+            sorted(paylines.ids))
+        total_problems = [
+            problem for problem in problems
+            if problem['code'] == 'negative_total']
+        self.assertEqual(len(total_problems), 1)
+        self.assertEqual(
+            total_problems[0]['payment_line_ids'], paylines[0].ids)
+        self.assertEqual(paylines.mapped('date'), dates)
+        # All the problems are reported at once on confirmation
+        with self.assertRaises(UserError) as e:
+            order.draft2open()
+        for problem in problems:
+            self.assertIn(problem['message'], e.exception.name)
+        self.assertEqual(order.state, 'draft')
+
+    def test_payment_conversion_rates(self):
+        currency_obj = self.env['res.currency']
+        eur = self.env.ref('base.EUR')
+        usd = self.env.ref('base.USD')
+        today = date.today().strftime('%Y-%m-%d')
+        rates = currency_obj._get_payment_conversion_rates([
+            (usd, eur, today), (usd, eur, today), (eur, eur, today)])
+        self.assertEqual(len(rates), 2)
+        self.assertEqual(rates[(eur, eur, today)], 1.0)
+        self.assertEqual(
+            usd._payment_convert(100.0, eur, rates[(usd, eur, today)]),
+            usd.with_context(date=today).compute(100.0, eur))
+        # The amounts are rounded in the same currency too, as by compute()
+        self.assertEqual(
+            eur._payment_convert(10.005, eur, rates[(eur, eur, today)]),
+            eur.compute(10.005, eur))
+
+    def test_sequence_batch(self):
+        names = self.env['ir.sequence'].next_by_code_batch(
+            'bank.payment.line', 3)
+        self.assertEqual(len(names), 3)
+        self.assertEqual(len(set(names)), 3)
+        self.assertEqual(
+            self.env['ir.sequence'].next_by_code_batch(
+                'bank.payment.line', 0), [])
+
+    def test_create_payment_lines_batch(self):
+        self.invoice.action_invoice_open()
+        self.invoice_02.action_invoice_open()
+        (self.invoice + self.invoice_02).create_account_payment_line()
+        order = self.env['account.payment.order'].search([
+            ('payment_mode_id', '=', self.mode.id),
+            ('state', '=', 'draft')])
+        paylines = order.payment_line_ids
+        self.assertEqual(len(paylines), 2)
+        self.assertEqual(len(set(paylines.mapped('name'))), 2)
+        self.assertNotIn('New', paylines.mapped('name'))
+        # The move lines are now excluded from the wizard and the invoice
+        # can not be added again
+        mlines = paylines.mapped('move_line_id')
+        amlo = self.env['account.move.line']
+        other_mlines = self.invoice.move_id.line_ids - mlines
+        self.assertFalse(amlo.search([
+            ('id', 'in', mlines.ids),
+            ('in_pending_payment_order', '=', False)]))
+        self.assertEqual(set(amlo.search([
+            ('id', 'in', (mlines + other_mlines).ids),
+            ('in_pending_payment_order', '=', True)]).ids), set(mlines.ids))
+        self.assertEqual(set(amlo.search([
+            ('id', 'in', (mlines + other_mlines).ids),
+            ('in_pending_payment_order', '!=', True)]).ids),
+            set(other_mlines.ids))
+        self.assertTrue(all(mlines.mapped('in_pending_payment_order')))
+        with self.assertRaises(UserError):
+            self.invoice.create_account_payment_line()
+        # The journal items of a cancelled order are no longer pending
+        order.action_cancel()
+        self.assertEqual(set(amlo.search([
+            ('id', 'in', mlines.ids),
+            ('in_pending_payment_order', '=', False)]).ids), set(mlines.ids))
+
+    def test_create_account_payment_line_action(self):
+        self.invoice.action_invoice_open()
+        self.invoice_02.action_invoice_open()
+        action = (
+            self.invoice + self.invoice_02).create_account_payment_line()
+        order = self.env['account.payment.order'].search([
+            ('payment_mode_id', '=', self.mode.id),
+            ('state', '=', 'draft')])
+        self.assertEqual(len(order), 1)
+        self.assertEqual(action['res_id'], order.id)
+        for invoice in self.invoice + self.invoice_02:
+            self.assertTrue(invoice.message_ids.filtered(
+                lambda x: order.name in (x.body or '')))
+
+    def test_open2generated_batch(self):
+        method = self.env['account.payment.method'].create({
+            'name': 'Method without handler',
+            'code': 'test_no_handler',
+            'payment_type': 'outbound',
+        })
+        self.mode.write({
+            'bank_account_link': 'fixed',
+            'fixed_journal_id': self.bank_journal.id,
+        })
+        mode2 = self.mode.copy({'payment_method_id': method.id})
+        self.invoice_02.payment_mode_id = mode2
+        self.invoice.action_invoice_open()
+        self.invoice_02.action_invoice_open()
+        (self.invoice + self.invoice_02).create_account_payment_line()
+        orders = self.env['account.payment.order'].search([
+            ('payment_mode_id', 'in', (self.mode + mode2).ids),
+            ('state', '=', 'draft')])
+        self.assertEqual(len(orders), 2)
+        orders.draft2open()
+        orders.open2generated_batch()
+        order = orders.filtered(lambda x: x.payment_mode_id == self.mode)
+        order2 = orders - order
+        self.assertEqual(order.state, 'generated')
+        self.assertEqual(order2.state, 'open')
+        self.assertTrue(order2.message_ids.filtered(
+            lambda x: 'could not be generated' in (x.body or '')))
+
+    def test_record_metrics(self):
+        self.mode.write({
+            'bank_account_link': 'fixed',
+            'fixed_journal_id': self.bank_journal.id,
+            'record_metrics': 'time',
+        })
+        self.invoice.action_invoice_open()
+        self.invoice.create_account_payment_line()
+        order = self.env['account.payment.order'].search([
+            ('payment_mode_id', '=', self.mode.id),
+            ('state', '=', 'draft')])
+        order.draft2open()
+        order.open2generated()
+        metrics = self.env['account.payment.order.metric'].search([
+            ('order_id', '=', order.id)])
+        self.assertEqual(
+            set(metrics.mapped('stage')),
+            {'draft2open', 'open2generated', 'generate_payment_file'})
+        metric = metrics.filtered(lambda x: x.stage == 'draft2open')
+        self.assertEqual(metric.line_count, 1)
+        self.assertGreater(metric.query_count, 0)
+        self.assertGreater(metric.rows_written, 0)
+        self.assertEqual(metric.memory_peak, 0)
+
+    def test_record_metrics_failed_stage(self):
+        self.mode.write({
+            'bank_account_link': 'fixed',
+            'fixed_journal_id': self.bank_journal.id,
+            'record_metrics': 'memory',
+        })
+        self.invoice.action_invoice_open()
+        self.invoice.create_account_payment_line()
+        order = self.env['account.payment.order'].search([
+            ('payment_mode_id', '=', self.mode.id),
+            ('state', '=', 'draft')])
+        with self.assertRaises(UserError):
+            with order._instrument_stage('draft2open'):
+                raise UserError('Failed stage')
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertFalse(self.env['account.payment.order.metric'].search([
+            ('order_id', '=', order.id)]))
+
+    def test_async_transitions(self):
+        self.mode.write({
+            'bank_account_link': 'fixed',
+            'fixed_journal_id': self.bank_journal.id,
+            'async_transitions': True,
+        })
+        self.invoice.action_invoice_open()
+        self.invoice.create_account_payment_line()
+        order = self.env['account.payment.order'].search([
+            ('payment_mode_id', '=', self.mode.id),
+            ('state', '=', 'draft')])
+        order.draft2open()
+        self.assertEqual(order.state, 'draft')
+        self.assertTrue(order.processing)
+        with self.assertRaises(UserError):
+            order.draft2open()
+        self.env['account.payment.order.job']._cron_run_jobs()
+        order.invalidate_cache()
+        self.assertEqual(order.state, 'open')
+        self.assertFalse(order.processing)
+        self.assertEqual(order.job_ids.state, 'done')
+        self.assertEqual(order.job_ids.progress, 100.0)
+        self.assertEqual(order.bank_line_count, 1)
+        self.assertFalse(order.open2generated_batch())
+        self.assertEqual(order.state, 'open')
+        self.assertTrue(order.processing)
+        with self.assertRaises(UserError):
+            order.open2generated_batch()
+        self.env['account.payment.order.job']._cron_run_jobs()
+        order.invalidate_cache()
+        self.assertEqual(order.state, 'generated')
+        order.generated2uploaded()
+        self.env['account.payment.order.job']._cron_run_jobs()
+        order.invalidate_cache()
+        self.assertEqual(order.state, 'uploaded')
+        self.assertTrue(order.bank_line_ids.transit_move_line_ids.reconciled)
+
+    def test_async_draft2open_failure(self):
+        self.mode.write({
+            'group_lines': False,
+            'bank_account_link': 'fixed',
+            'fixed_journal_id': self.bank_journal.id,
+            'async_transitions': True,
+        })
+        self.invoice.action_invoice_open()
+        self.invoice_02.action_invoice_open()
+        (self.invoice + self.invoice_02).create_account_payment_line()
+        order = self.env['account.payment.order'].search([
+            ('payment_mode_id', '=', self.mode.id),
+            ('state', '=', 'draft')])
+        order.draft2open()
+        job = order.job_ids
+        bplo = self.env['bank.payment.line']
+        create_batch = type(bplo)._create_batch
+        chunks = []
+
+        def failing_create_batch(model, vals_list):
+            # The second chunk fails, after the first one is committed
+            chunks.append(vals_list)
+            if len(chunks) > 1:
+                raise UserError('Failed chunk')
+            return create_batch(model, vals_list)
+
+        with mock.patch.object(
+                account_payment_order_job, 'JOB_CHUNK_SIZE', 1), \
+                mock.patch.object(
+                    type(bplo), '_create_batch', failing_create_batch):
+            self.env['account.payment.order.job']._cron_run_jobs()
+        order.invalidate_cache()
+        job.invalidate_cache()
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(job.state, 'failed')
+        self.assertEqual(order.state, 'draft')
+        self.assertFalse(order.bank_line_ids)
+        # The confirmation can be launched again
+        order.draft2open()
+        self.env['account.payment.order.job']._cron_run_jobs()
+        order.invalidate_cache()
+        self.assertEqual(order.state, 'open')
+        self.assertEqual(order.bank_line_count, 2)
@@ -109,12 +109,9 @@ class AccountPaymentLineCreate(models.TransientModel):
         # Exclude lines that are already in a non-cancelled
         # and non-uploaded payment order; lines that are in a
         # uploaded payment order are proposed if they are not reconciled,
-        paylines = self.env['account.payment.line'].search([
-            ('state', 'in', ('draft', 'open', 'generated')),
-            ('move_line_id', '!=', False)])
-        if paylines:
-            move_lines_ids = [payline.move_line_id.id for payline in paylines]
-            domain += [('id', 'not in', move_lines_ids)]
+        # The exclusion is done with a sub-query in SQL, cf the field
+        # in_pending_payment_order on account.move.line
+        domain.append(('in_pending_payment_order', '=', False))
         return domain
 
     @api.multi
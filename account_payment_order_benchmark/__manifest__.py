@@ -0,0 +1,16 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+{
+    'name': 'Account Payment Order Benchmark',
+    'summary': 'Benchmark of the payment orders on synthetic data',
+    'version': '11.0.1.0.0',
+    'license': 'AGPL-3',
+    'author': "Odoo Community Association (OCA)",
+    'website': 'https://github.com/OCA/bank-payment',
+    'category': 'Hidden',
+    'depends': [
+        'account_banking_sepa_credit_transfer',
+        'account_banking_sepa_direct_debit',
+    ],
+    'installable': True,
+}
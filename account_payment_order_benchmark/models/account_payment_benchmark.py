@@ -0,0 +1,292 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+import json
+import logging
+import time
+from contextlib import contextmanager
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+MOVE_CHUNK_SIZE = 500
+
+
+def _iban(country_code, bban):
+    """Return a valid IBAN for the given country and BBAN (ISO 13616)"""
+    digits = ''.join(
+        str(int(char, 36)) for char in bban + country_code + '00')
+    return '%s%02d%s' % (country_code, 98 - int(digits) % 97, bban)
+
+
+class AccountPaymentBenchmark(models.AbstractModel):
+    """Benchmark of the payment pipeline on synthetic data.
+
+    For each size and each flow (SEPA credit transfer of supplier
+    payables and SEPA direct debit of customer receivables), synthetic
+    partners, bank accounts, mandates and journal items are generated
+    then each stage of the payment order is timed, from the wizard that
+    selects the journal items to the reconciliation of the transfer moves.
+    Everything is rolled back after each run.
+
+    Run it from an Odoo shell, on a database with a chart of accounts:
+        env['account.payment.benchmark'].run_benchmark(
+            sizes=[1000], output='/tmp/payment_benchmark.json')
+    """
+    _name = 'account.payment.benchmark'
+    _description = 'Payment Pipeline Benchmark'
+
+    @api.model
+    def _get_account(self, user_type_xmlid):
+        account = self.env['account.account'].search([
+            ('user_type_id', '=', self.env.ref(user_type_xmlid).id),
+            ('company_id', '=', self.env.user.company_id.id)], limit=1)
+        if not account:
+            raise UserError(_(
+                "The benchmark needs a chart of accounts with an account of "
+                "type %s.") % user_type_xmlid)
+        return account
+
+    @api.model
+    def _create_environment(self):
+        """Create the bank journal, the journal of the synthetic items and
+        the SEPA payment modes used by the benchmark"""
+        company = self.env.user.company_id
+        company_bank = self.env['res.partner.bank'].create({
+            'acc_number': _iban('DE', '10010010%010d' % 0),
+            'partner_id': company.partner_id.id,
+            'company_id': company.id,
+        })
+        bank_journal = self.env['account.journal'].create({
+            'name': 'Benchmark Bank',
+            'type': 'bank',
+            'code': 'BNCHB',
+            'bank_account_id': company_bank.id,
+            'company_id': company.id,
+        })
+        journal = self.env['account.journal'].create({
+            'name': 'Benchmark Items',
+            'type': 'general',
+            'code': 'BNCHI',
+            'company_id': company.id,
+        })
+        mode_vals = {
+            'bank_account_link': 'fixed',
+            'fixed_journal_id': bank_journal.id,
+            'default_journal_ids': [(6, 0, journal.ids)],
+            'company_id': company.id,
+        }
+        sct_mode = self.env['account.payment.mode'].create(dict(
+            mode_vals, name='Benchmark SEPA Credit Transfer',
+            payment_method_id=self.env.ref(
+                'account_banking_sepa_credit_transfer.'
+                'sepa_credit_transfer').id))
+        sdd_mode = self.env['account.payment.mode'].create(dict(
+            mode_vals, name='Benchmark SEPA Direct Debit',
+            payment_method_id=self.env.ref(
+                'account_banking_sepa_direct_debit.sepa_direct_debit').id,
+            sepa_creditor_identifier='FR78ZZZ424242'))
+        return {
+            'journal': journal,
+            'outbound': sct_mode,
+            'inbound': sdd_mode,
+        }
+
+    @api.model
+    def _generate_data(self, size, payment_type, bench_env,
+                       lines_per_partner=1):
+        """Generate the partners, bank accounts, mandates (for direct
+        debits) and posted journal items to pay. Journal entries are
+        generated instead of invoices: they give the same journal items
+        to the payment orders, for a fraction of the generation time.
+        Returns the generated journal items to pay"""
+        nb_partners = max(1, size // lines_per_partner)
+        partner_ids = []
+        bank_ids = []
+        mandate_ids = []
+        country = self.env.ref('base.de')
+        signature_date = fields.Date.context_today(self)
+        for i in range(nb_partners):
+            partner = self.env['res.partner'].create({
+                'name': 'Benchmark Partner %d' % i,
+                'street': 'Street %d' % i,
+                'zip': '%05d' % (i % 100000),
+                'city': 'Berlin',
+                'country_id': country.id,
+            })
+            bank = self.env['res.partner.bank'].create({
+                'acc_number': _iban('DE', '20020020%010d' % i),
+                'partner_id': partner.id,
+            })
+            if payment_type == 'inbound':
+                mandate = self.env['account.banking.mandate'].create({
+                    'partner_bank_id': bank.id,
+                    'format': 'sepa',
+                    'type': 'recurrent',
+                    'recurrent_sequence_type': 'recurring',
+                    'signature_date': signature_date,
+                    'state': 'valid',
+                })
+                mandate_ids.append(mandate.id)
+            partner_ids.append(partner.id)
+            bank_ids.append(bank.id)
+        if payment_type == 'outbound':
+            account = self._get_account('account.data_account_type_payable')
+            counterpart_account = self._get_account(
+                'account.data_account_type_expenses')
+            amount_field, counterpart_field = 'credit', 'debit'
+        else:
+            account = self._get_account(
+                'account.data_account_type_receivable')
+            counterpart_account = self._get_account(
+                'account.data_account_type_revenue')
+            amount_field, counterpart_field = 'debit', 'credit'
+        today = fields.Date.context_today(self)
+        move_ids = []
+        for start in range(0, size, MOVE_CHUNK_SIZE):
+            line_vals = []
+            total = 0.0
+            for i in range(start, min(start + MOVE_CHUNK_SIZE, size)):
+                index = i % nb_partners
+                amount = 10.0 + i % 1000
+                total += amount
+                vals = {
+                    'name': 'BENCH%07d' % i,
+                    'account_id': account.id,
+                    'partner_id': partner_ids[index],
+                    'partner_bank_id': bank_ids[index],
+                    'date_maturity': today,
+                    amount_field: amount,
+                }
+                if mandate_ids:
+                    vals['mandate_id'] = mandate_ids[index]
+                line_vals.append((0, 0, vals))
+            line_vals.append((0, 0, {
+                'name': 'Benchmark counterpart',
+                'account_id': counterpart_account.id,
+                counterpart_field: total,
+            }))
+            move = self.env['account.move'].create({
+                'journal_id': bench_env['journal'].id,
+                'date': today,
+                'ref': 'BENCH%d' % start,
+                'line_ids': line_vals,
+            })
+            move.post()
+            move_ids.append(move.id)
+        return self.env['account.move.line'].search([
+            ('move_id', 'in', move_ids),
+            ('account_id', '=', account.id)])
+
+    @contextmanager
+    def _time_stage(self, results, stage, **values):
+        """Measure the wall time and the number of SQL queries of the
+        block, and append the measure to results"""
+        queries = self.env.cr.sql_log_count
+        start = time.time()
+        yield
+        values.update({
+            'stage': stage,
+            'duration': round(time.time() - start, 3),
+            'queries': self.env.cr.sql_log_count - queries,
+        })
+        results.append(values)
+
+    @api.model
+    def _order_metric_stage(self, order, stage, **values):
+        """Return the measure of a stage recorded by the payment order
+        itself, cf AccountPaymentOrder._instrument_stage()"""
+        metrics = self.env['account.payment.order.metric'].search([
+            ('order_id', '=', order.id),
+            ('stage', '=', stage)])
+        values.update({
+            'stage': stage,
+            'duration': round(sum(metrics.mapped('duration')), 3),
+            'queries': sum(metrics.mapped('query_count')),
+        })
+        return values
+
+    @api.model
+    def _run_flow(self, size, payment_type, lines_per_partner=1):
+        """Run the whole pipeline for one flow and one size and return the
+        measures of each stage"""
+        results = []
+        flow = payment_type == 'outbound' and 'sct' or 'sdd'
+        bench_env = self._create_environment()
+        mode = bench_env[payment_type]
+        mlines = self._generate_data(
+            size, payment_type, bench_env,
+            lines_per_partner=lines_per_partner)
+        self.env.invalidate_all()
+        info = {'flow': flow, 'size': size}
+        order = self.env['account.payment.order'].create({
+            'payment_type': payment_type,
+            'payment_mode_id': mode.id,
+        })
+        wizard = self.env['account.payment.line.create'].with_context(
+            active_model='account.payment.order', active_id=order.id
+        ).create({
+            'journal_ids': [(6, 0, bench_env['journal'].ids)],
+            'date_type': 'due',
+            'due_date': fields.Date.context_today(self),
+            'payment_mode': 'any',
+        })
+        with self._time_stage(results, 'wizard_populate', **info):
+            wizard.populate()
+        if len(wizard.move_line_ids) != len(mlines):
+            raise UserError(_(
+                "The wizard selected %d journal items instead of %d.")
+                % (len(wizard.move_line_ids), len(mlines)))
+        with self._time_stage(results, 'create_payment_lines', **info):
+            wizard.create_payment_lines()
+        with self._time_stage(results, 'draft2open', **info):
+            order.draft2open()
+        with self._time_stage(results, 'generate_payment_file', **info):
+            payment_file_str, filename = order.generate_payment_file()
+        info['file_size'] = len(payment_file_str)
+        with self._time_stage(results, 'attach_payment_file', **info):
+            order._set_generated(payment_file_str, filename)
+        # The reconciliation is run inside generate_move(): its measure
+        # is recorded by the payment order and removed from the one of
+        # generated2uploaded, so that it is reported as its own stage
+        with self._time_stage(results, 'generated2uploaded', **info):
+            order.with_context(
+                payment_order_metrics='time').generated2uploaded()
+        upload = results[-1]
+        reconcile = self._order_metric_stage(
+            order, 'reconcile_payment_lines', **info)
+        upload['duration'] = round(
+            upload['duration'] - reconcile['duration'], 3)
+        upload['queries'] -= reconcile['queries']
+        results.append(reconcile)
+        for values in results:
+            logger.info(
+                "Payment benchmark %(flow)s %(size)s lines, %(stage)s: "
+                "%(duration)ss, %(queries)s queries", values)
+        return results
+
+    @api.model
+    def run_benchmark(self, sizes=DEFAULT_SIZES, flows=('sct', 'sdd'),
+                      lines_per_partner=1, output=None):
+        """Run the benchmark for each size and flow. The data of each run
+        are rolled back. Returns the list of the measures, and writes them
+        as JSON in the file output, if given"""
+        flow2type = {'sct': 'outbound', 'sdd': 'inbound'}
+        results = []
+        cr = self.env.cr
+        for size in sizes:
+            for flow in flows:
+                cr.execute('SAVEPOINT payment_benchmark')
+                try:
+                    results += self._run_flow(
+                        size, flow2type[flow],
+                        lines_per_partner=lines_per_partner)
+                finally:
+                    cr.execute('ROLLBACK TO SAVEPOINT payment_benchmark')
+                    self.env.invalidate_all()
+        if output:
+            with open(output, 'w') as output_file:
+                json.dump(results, output_file, indent=2)
+        return results
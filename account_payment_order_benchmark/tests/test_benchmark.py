@@ -0,0 +1,28 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+from odoo.addons.account.tests.account_test_classes import AccountingTestCase
+
+
+class TestBenchmark(AccountingTestCase):
+
+    def test_benchmark(self):
+        self.env.user.company_id.currency_id = self.env.ref('base.EUR')
+        partner_count = self.env['res.partner'].search_count([])
+        results = self.env['account.payment.benchmark'].run_benchmark(
+            sizes=[5])
+        stages = [
+            'wizard_populate', 'create_payment_lines', 'draft2open',
+            'generate_payment_file', 'attach_payment_file',
+            'generated2uploaded', 'reconcile_payment_lines']
+        self.assertEqual(
+            [(res['flow'], res['stage']) for res in results],
+            [('sct', stage) for stage in stages] +
+            [('sdd', stage) for stage in stages])
+        for res in results:
+            self.assertEqual(res['size'], 5)
+            self.assertGreater(res['queries'], 0)
+            if res['stage'] == 'generated2uploaded':
+                self.assertGreater(res['file_size'], 0)
+        # The synthetic data are rolled back
+        self.assertEqual(
+            self.env['res.partner'].search_count([]), partner_count)